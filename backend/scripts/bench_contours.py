@@ -0,0 +1,90 @@
+"""
+Сравнение старого извлечения контуров (findContours -> drawContours ->
+skimage.find_contours -> дедупликация через set) с mask_to_polygons.
+
+Запуск из папки backend:
+    python -m scripts.bench_contours --size 512 --repeat 50
+"""
+import argparse
+import time
+
+import cv2
+import numpy as np
+from scipy.spatial import cKDTree
+from skimage import measure
+
+from src.service.contours import mask_to_polygons
+
+
+def legacy_contours(mask):
+    mask = mask.astype(np.uint8) * 255
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    contour_mask = np.zeros_like(mask)
+    if contours:
+        cv2.drawContours(contour_mask, contours, -1, 255, thickness=1)
+
+    mass_check = set()
+    contours_list = []
+    for contour in measure.find_contours(contour_mask, level=0.7):
+        new_counter = []
+        for point in contour:
+            tupl = (round(point[1], 1), round(point[0], 1))
+            if tupl not in mass_check:
+                mass_check.add(tupl)
+                new_counter.append(list(tupl))
+        contours_list.append(new_counter)
+    return contours_list
+
+
+def liver_mask(size, seed):
+    """Большая «печень»: эллипс с неровным краем и маленький отдельный кусок."""
+    rng = np.random.default_rng(seed)
+    mask = np.zeros((size, size), dtype=np.uint8)
+    angles = np.linspace(0, 2 * np.pi, 90, endpoint=False)
+    radius = size * 0.3 * (1 + 0.08 * rng.standard_normal(len(angles)))
+    points = np.stack([size * 0.45 + radius * np.cos(angles) * 1.2,
+                       size * 0.5 + radius * np.sin(angles)], axis=1).astype(np.int32)
+    cv2.fillPoly(mask, [points], 1)
+    cv2.circle(mask, (int(size * 0.85), int(size * 0.2)), size // 30, 1, -1)
+    return mask.astype(bool)
+
+
+def timed(func, mask, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = func(mask)
+    return (time.perf_counter() - start) / repeat * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark contour extraction')
+    parser.add_argument('--size', type=int, nargs='+', default=[256, 512])
+    parser.add_argument('--masks', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    for size in args.size:
+        legacy_ms, new_ms, distances, points_legacy, points_new = [], [], [], 0, 0
+        for seed in range(args.masks):
+            mask = liver_mask(size, seed)
+            t_legacy, legacy = timed(legacy_contours, mask, args.repeat)
+            t_new, new = timed(mask_to_polygons, mask, args.repeat)
+            legacy_ms.append(t_legacy)
+            new_ms.append(t_new)
+
+            legacy_pts = np.concatenate([np.array(c) for c in legacy if c])
+            new_pts = np.concatenate([np.array(c) for c in new if c])
+            points_legacy += len(legacy_pts)
+            points_new += len(new_pts)
+            # Симметричное расстояние Хаусдорфа между облаками точек
+            distances.append(max(cKDTree(legacy_pts).query(new_pts)[0].max(),
+                                 cKDTree(new_pts).query(legacy_pts)[0].max()))
+
+        print(f"{size}x{size}: legacy {np.mean(legacy_ms):.2f} ms, new {np.mean(new_ms):.2f} ms "
+              f"(x{np.mean(legacy_ms) / np.mean(new_ms):.1f}), "
+              f"points {points_legacy // args.masks} -> {points_new // args.masks}, "
+              f"max Hausdorff {max(distances):.2f} px")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""
+Накладные расходы на один вызов S3: новый клиент на каждую операцию (как было)
+против одного долгоживущего клиента с пулом соединений (как в S3Client сейчас).
+
+Запуск из папки backend против локального S3-совместимого хранилища (MinIO, moto_server):
+    python -m scripts.bench_s3 --endpoint http://localhost:9000 --access-key minioadmin \
+        --secret-key minioadmin --bucket bench --requests 200 --size 65536
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from aiobotocore.config import AioConfig
+from aiobotocore.session import get_session
+
+
+def client_kwargs(args, pooled):
+    kwargs = {
+        "aws_access_key_id": args.access_key,
+        "aws_secret_access_key": args.secret_key,
+        "endpoint_url": args.endpoint,
+        "region_name": args.region,
+    }
+    if pooled:
+        kwargs["config"] = AioConfig(
+            max_pool_connections=args.concurrency,
+            retries={"max_attempts": 5, "mode": "adaptive"},
+            tcp_keepalive=True,
+            connector_args={"keepalive_timeout": 60},
+        )
+    return kwargs
+
+
+async def per_call_client(session, args, key):
+    async with session.create_client("s3", **client_kwargs(args, pooled=False)) as client:
+        response = await client.get_object(Bucket=args.bucket, Key=key)
+        await response['Body'].read()
+
+
+async def run(label, call, args):
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies = []
+
+    async def timed(i):
+        async with semaphore:
+            start = time.perf_counter()
+            await call(f"bench/{i % args.objects}")
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(timed(i) for i in range(args.requests)))
+    total = time.perf_counter() - start
+    latencies.sort()
+    print(f"{label}: {args.requests / total:.0f} req/s, "
+          f"p50 {statistics.median(latencies):.1f} ms, "
+          f"p95 {latencies[int(len(latencies) * 0.95) - 1]:.1f} ms")
+
+
+async def bench(args):
+    session = get_session()
+    async with session.create_client("s3", **client_kwargs(args, pooled=True)) as client:
+        try:
+            await client.head_bucket(Bucket=args.bucket)
+        except Exception:
+            await client.create_bucket(Bucket=args.bucket)
+        body = b'\0' * args.size
+        for i in range(args.objects):
+            await client.put_object(Bucket=args.bucket, Key=f"bench/{i}", Body=body)
+
+        async def pooled_call(key):
+            response = await client.get_object(Bucket=args.bucket, Key=key)
+            await response['Body'].read()
+
+        await run("new client per call", lambda key: per_call_client(session, args, key), args)
+        await run("pooled client", pooled_call, args)
+
+        for i in range(args.objects):
+            await client.delete_object(Bucket=args.bucket, Key=f"bench/{i}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark S3 per-call overhead')
+    parser.add_argument('--endpoint', default='http://localhost:9000')
+    parser.add_argument('--access-key', default='minioadmin')
+    parser.add_argument('--secret-key', default='minioadmin')
+    parser.add_argument('--region', default='us-east-1')
+    parser.add_argument('--bucket', default='bench')
+    parser.add_argument('--objects', type=int, default=10)
+    parser.add_argument('--size', type=int, default=64 * 1024)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=16)
+    asyncio.run(bench(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""
+Проверка, что хранение тома в float16 / uint16 не меняет выход модели.
+
+Запуск из папки backend:
+    python -m scripts.check_storage_dtype --eval ct_1.nii --atol 1e-2 --min-dice 0.995
+
+Том сохраняется через dump_volume с каждым типом хранения, читается обратно
+и прогоняется через модель; сравниваются логиты и маски с float32.
+"""
+import argparse
+import sys
+
+import numpy as np
+import torch
+
+from src.service.model import ModelSegmentationManager
+from src.service.quantize import load_volume, synthetic_volume, dice
+from src.service.volume_format import dump_volume, load_volume as read_volume
+
+
+def compare(manager, reference, candidate, batch_size):
+    depth = reference.shape[2]
+    max_diff, dices = 0.0, []
+    for start in range(0, depth, batch_size):
+        stop = min(start + batch_size, depth)
+        with torch.no_grad():
+            expected = manager.model(manager.pred_volume(reference, start, stop))
+            actual = manager.model(manager.pred_volume(candidate, start, stop))
+        max_diff = max(max_diff, (expected - actual).abs().max().item())
+        for exp, act in zip((torch.sigmoid(expected) > 0.7).cpu().numpy(),
+                            (torch.sigmoid(actual) > 0.7).cpu().numpy()):
+            dices.append(dice(exp, act))
+    return max_diff, float(np.mean(dices)), float(np.min(dices))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare model output for reduced-precision volume storage')
+    parser.add_argument('--eval', nargs='*', default=[], help='.nii/.nii.gz volumes')
+    parser.add_argument('--dtypes', nargs='+', default=['float16', 'uint16'])
+    parser.add_argument('--backend', default='eager')
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--atol', type=float, default=1e-2, help='max abs difference of logits')
+    parser.add_argument('--min-dice', type=float, default=0.995)
+    args = parser.parse_args()
+
+    manager = ModelSegmentationManager()
+    manager.upload_model(args.backend)
+
+    volumes = [('synthetic', synthetic_volume())] + [(path, load_volume(path)) for path in args.eval]
+    failed = False
+    for name, volume in volumes:
+        volume = volume.astype(np.float32)
+        for dtype in args.dtypes:
+            stored = read_volume(dump_volume(volume, dtype=dtype))
+            max_diff, dice_mean, dice_min = compare(manager, volume, stored, args.batch_size)
+            ok = max_diff <= args.atol and dice_mean >= args.min_dice
+            failed |= not ok
+            print(f"{'✅' if ok else '❌'} {name} [{dtype}, {stored.nbytes / volume.nbytes:.2f}x size]: "
+                  f"max logit diff {max_diff:.2e}, Dice {dice_mean:.4f} (min {dice_min:.4f})")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
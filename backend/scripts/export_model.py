@@ -0,0 +1,43 @@
+"""
+Экспорт model.pth в TorchScript и ONNX с проверкой против eager PyTorch.
+
+Запуск из папки backend:
+    python -m scripts.export_model --atol 1e-3
+"""
+import argparse
+import sys
+
+import torch
+
+from src.service.backends import (
+    MODEL_PATHS, load_eager, load_torchscript, load_onnx,
+    export_torchscript, export_onnx, compare_backends,
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export model.pth to TorchScript and ONNX')
+    parser.add_argument('--weights', default=MODEL_PATHS['eager'])
+    parser.add_argument('--targets', nargs='+', default=['torchscript', 'onnx'], choices=['torchscript', 'onnx'])
+    parser.add_argument('--atol', type=float, default=1e-3, help='max abs difference of logits vs eager')
+    args = parser.parse_args()
+
+    device = torch.device('cpu')
+    reference = load_eager(1, device, path=args.weights)
+
+    exporters = {'torchscript': (export_torchscript, load_torchscript),
+                 'onnx': (export_onnx, load_onnx)}
+    failed = False
+    for target in args.targets:
+        export, load = exporters[target]
+        path = export(reference)
+        diff = compare_backends(reference, load(1, device, path=path))
+        ok = diff <= args.atol
+        failed |= not ok
+        print(f"{'✅' if ok else '❌'} {target}: {path}, max abs diff {diff:.2e} (atol {args.atol:.0e})")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+"""
+INT8-квантизация модели и проверка точности относительно fp32.
+
+Сначала нужен model.onnx (python -m scripts.export_model). Запуск из папки backend:
+    python -m scripts.quantize_model --calibration ct_1.nii ct_2.nii.gz --eval ct_3.nii --min-dice 0.98
+
+Без --calibration калибровка идёт по синтетическому тому. Сравнение всегда
+делается на синтетическом томе и на всех томах из --eval.
+"""
+import argparse
+import sys
+
+from src.service.model import ModelSegmentationManager
+from src.service.quantize import load_volume, synthetic_volume, quantize_onnx, compare_masks
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Quantize the model to INT8 and compare masks with fp32')
+    parser.add_argument('--calibration', nargs='*', default=[], help='.nii/.nii.gz volumes for calibration')
+    parser.add_argument('--eval', nargs='*', default=[], help='.nii/.nii.gz volumes for the accuracy check')
+    parser.add_argument('--max-slices', type=int, default=64, help='calibration slices in total')
+    parser.add_argument('--skip-quantize', action='store_true', help='only compare the existing model.int8.onnx')
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--min-dice', type=float, default=0.98, help='fail if mean Dice of any volume is lower')
+    args = parser.parse_args()
+
+    if not args.skip_quantize:
+        calibration = [load_volume(path) for path in args.calibration] or [synthetic_volume(seed=1)]
+        print(f'Calibrating on {len(calibration)} volume(s)...')
+        print(f'✅ INT8 model written to {quantize_onnx(calibration, max_slices=args.max_slices)}')
+
+    fp32, int8 = ModelSegmentationManager(), ModelSegmentationManager()
+    fp32.upload_model('eager')
+    int8.upload_model('onnx-int8')
+
+    volumes = [('synthetic', synthetic_volume())] + [(path, load_volume(path)) for path in args.eval]
+    failed = False
+    for name, volume in volumes:
+        report = compare_masks(fp32, int8, volume, batch_size=args.batch_size)
+        ok = report['dice_mean'] >= args.min_dice
+        failed |= not ok
+        print(f"{'✅' if ok else '❌'} {name}: {report['slices']} slices, "
+              f"Dice {report['dice_mean']:.4f} (min {report['dice_min']:.4f}), "
+              f"IoU {report['iou_mean']:.4f} (min {report['iou_min']:.4f})")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,11 @@
+from fastapi import APIRouter, Response
+
+from src.service.metrics import cache_metrics
+
+router = APIRouter()
+
+
+@router.get('/metrics', include_in_schema=False)
+async def get_metrics():
+    """Метрики кэша этого воркера в формате Prometheus (без авторизации, для сборщика)."""
+    return Response(content=cache_metrics.prometheus(), media_type="text/plain; version=0.0.4")
@@ -12,4 +12,5 @@ router = APIRouter(prefix="/v1", dependencies=[Depends(for_documentation)])
 router.include_router(routers.files)
 router.include_router(routers.auth)
 router.include_router(routers.photos)
-router.include_router(routers.contours)
\ No newline at end of file
+router.include_router(routers.contours)
+router.include_router(routers.cache)
\ No newline at end of file
@@ -2,3 +2,4 @@ from .files import router as files  # noqa: F401
 from .auth import router as auth  # noqa: F401
 from .photos import router as photos  # noqa: F401
 from .contours import router as contours  # noqa: F401
+from .cache import router as cache  # noqa: F401
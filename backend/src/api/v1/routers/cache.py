@@ -0,0 +1,21 @@
+from fastapi import APIRouter
+
+from src.service.redis_conn import keyspace_stats_cache
+from src.service.metrics import cache_metrics
+
+router = APIRouter(prefix='/cache')
+
+
+@router.get('/keyspaces')
+async def get_keyspaces() -> dict:
+    """
+    Семейства ключей Redis: число ключей, TTL (настроенный и средний оставшийся), оценка объёма.
+    Снимок считается в фоне раз в KEYSPACE_STATS_INTERVAL секунд (computed_at - unix time).
+    """
+    return keyspace_stats_cache.snapshot
+
+
+@router.get('/metrics')
+async def get_cache_metrics() -> dict:
+    """Попадания (L1 / Redis), промахи, байты и гистограммы задержек по семействам ключей в этом воркере."""
+    return cache_metrics.snapshot()
@@ -1,3 +1,5 @@
+import json
+
 from fastapi import APIRouter, BackgroundTasks, Request, Path, Depends, HTTPException, status
 from pydantic import UUID4, BaseModel
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -7,6 +9,7 @@ from src.config import settings
 from src.db.db import get_async_session
 from src.db.manager_files import fileManager
 from src.service.redis_conn import get_metadata
+from src.service.contour_codec import MEDIA_TYPE, decode_contours, check_points
 from src.models import Contours
 from src.utils.s3_jobs import save_add_photo_s3_contour
 
@@ -15,12 +18,35 @@ class ContoursSave(BaseModel):
     points: list[list[list[float]] | list[float]]
 
 
+async def read_contours(request: Request) -> dict:
+    """
+    Тело save: JSON {"points": [...]} (схема ContoursSave) или LCNT с Content-Type: application/x-lcnt.
+    Большие списки точек проверяются через numpy, а не вложенной pydantic-моделью.
+    """
+    body = await request.body()
+    try:
+        if request.headers.get('content-type', '').startswith(MEDIA_TYPE):
+            points = decode_contours(body)
+        else:
+            data = json.loads(body)
+            if not isinstance(data, dict):
+                raise ValueError("Expected object with points")
+            points = check_points(data.get('points'))
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                            detail={"msg": str(e), "request_id": request.state.request_id})
+    return {'points': points}
+
+
 router = APIRouter()
 
 
-@router.post('/{file_uuid}/{num_slices}/save')
+@router.post('/{file_uuid}/{num_slices}/save', openapi_extra={'requestBody': {'required': True, 'content': {
+    'application/json': {'schema': ContoursSave.model_json_schema()},
+    MEDIA_TYPE: {'schema': {'type': 'string', 'format': 'binary'}},
+}}})
 async def save_contours(background_task: BackgroundTasks, file_uuid: UUID4, request: Request,
-                        contours: ContoursSave,
+                        contours: dict = Depends(read_contours),
                         num_slices: int = Path(ge=0),
                         session: AsyncSession = Depends(get_async_session)):
     request_id = request.state.request_id
@@ -56,7 +82,7 @@ async def save_contours(background_task: BackgroundTasks, file_uuid: UUID4, requ
         version=version,
         author_id=user_id,
         file_uuid=file_uuid,
-        contours=dict(contours),
+        contours=contours,
         num_images=num_slices,
         url=f'.png',
     )
@@ -1,43 +1,83 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+
 from fastapi import (
     APIRouter, UploadFile, File, Depends,
     BackgroundTasks, HTTPException,
-    status, Request, Response
+    status, Request, Response, Query
 )
+from pydantic import UUID4
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from src.config import settings
 from src.db.db import get_async_session
 from src.db.manager_files import fileManager
 from src.logger import api_logger
 from src.service.model import modelManager
-from src.schemas.predict import Predict
+from src.service.inference import inference_executor
+from src.service.prefetch import prefetcher
+from src.schemas.predict import Predict, SegmentVolume, DerivativesProgress
 from src.service.redis_conn import (
     load_files_redis,
-    get_result_cached,
-    load_result_cached, get_metadata, load_contours_cached, get_contours_cached
+    get_result_cached, get_metadata,
+    load_contours_volume_cached, get_derivatives_progress, load_alias_metadata
 )
 from src.schemas import files
-from src.utils.file import get_file_bytes
+from src.utils.file import get_file_bytes, get_file_slice, resolve_storage, processed_obj_name, check_file_access
 from src.utils.s3_jobs import upload_files_to_s3
+from src.utils.derivatives import derivative_pipeline, get_slice_contours, get_slice_result
+from src.utils.mask_volume import upload_mask_volume, get_mask_volume
+from src.service.masks import pack_masks, unpack_masks, mask_statistics
+from src.service.s3 import s3_client
+from src.utils.upload import spool_upload, decode_nii
 
 router = APIRouter()
 
+# Одновременно декодируемые загрузки - чтобы память подов не росла с числом загрузок
+upload_semaphore = asyncio.Semaphore(settings.UPLOAD_MAX_CONCURRENT)
+# Свои потоки для декодирования: загрузки не занимают очередь модели и не получают её 503
+decode_executor = ThreadPoolExecutor(max_workers=settings.UPLOAD_MAX_CONCURRENT, thread_name_prefix='decode')
+
 
-async def check_nii_file(file: UploadFile = File(...)):
-    if not file.filename.endswith('.nii'):
+async def check_nii_file(request: Request, file: UploadFile = File(...),
+                         session: AsyncSession = Depends(get_async_session)):
+    if not file.filename.endswith(('.nii', '.nii.gz')):
         api_logger.warning("Invalid file format: %s", file.filename)
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail={"msg": "Only .nii files are supported"}
+            detail={"msg": "Only .nii and .nii.gz files are supported"}
         )
 
+    nii_file = None
     try:
+        async with upload_semaphore:
+            nii_file, size, content_hash = await spool_upload(file, settings.UPLOAD_SPOOL_MAX_BYTES)
+            # То же содержимое уже загружали - декодировать и обрабатывать заново не нужно
+            original = await fileManager.get_by_hash(session, content_hash, request.state.request_id)
+            # Обработанный том исходной загрузки мог ещё не доехать до S3 (фоновая задача) или не доехать совсем
+            if original is not None and not await s3_client.exists(processed_obj_name(original.uuid),
+                                                                   settings.S3_PRIVATE_BUCKET_NAME,
+                                                                   request.state.request_id):
+                original = None
+            image_volume, spacing, processed_path = None, None, None
+            if original is None:
+                # Том пишется сразу во временный LVOL-файл (memmap), а не в память процесса
+                image_volume, spacing, processed_path = await asyncio.get_running_loop().run_in_executor(
+                    decode_executor, decode_nii, nii_file, settings.UPLOAD_DECODE_BUDGET_BYTES,
+                    settings.VOLUME_STORAGE_DTYPE, settings.UPLOAD_TMP_DIR
+                )
+        nii_file.seek(0)
+        return (file.filename.removesuffix('.gz'), image_volume, size, nii_file, spacing, content_hash, original,
+                processed_path)
 
-        file_bytes = await file.read()
-        image_volume = modelManager.read_nii(file_bytes)
-        image_volume = modelManager.preprocess_im(image_volume)
-        return file.filename, image_volume, len(file_bytes), file_bytes
-
+    except HTTPException:
+        if nii_file:
+            nii_file.close()
+        raise
     except Exception as e:
+        if nii_file:
+            nii_file.close()
         api_logger.warning(
             "Failed to process .nii file (possible corrupt/invalid data)",
             extra={"file_name": file.filename}
@@ -53,10 +93,11 @@ async def upload_file(
         request: Request,
         background_task: BackgroundTasks,
         metafile=Depends(check_nii_file),
+        derivatives: bool = Query(settings.DERIVATIVES_ON_UPLOAD),
         session: AsyncSession = Depends(get_async_session),
 ) -> files.File:
-    filename, image_volume, size_file, file_bytes = metafile
-    num_slices = image_volume.shape[2] - 1
+    filename, image_volume, size_file, nii_file, spacing, content_hash, original, processed_path = metafile
+    num_slices = original.num_slices if original is not None else image_volume.shape[2] - 1
     request_id = request.state.request_id
     user_id = getattr(request.state, "user_id", None)
 
@@ -66,26 +107,53 @@ async def upload_file(
             'filename': filename,
             'size_bytes': size_file,
             'num_slices': num_slices,
-            "is_public": True
+            "is_public": True,
+            'content_hash': content_hash,
         }
         if user_id is not None:
             data['author_id'] = user_id
+        if original is not None:
+            data['storage_uuid'] = original.uuid
         file_orm = await fileManager.create(
             session,
             data,
             request_id
         )
 
-        await load_files_redis(file_orm.uuid, image_volume, num_slices, str(file_orm.author_id), file_orm.is_public)
+        if original is not None:
+            # Дубликат: своя строка Files (владелец, is_public), а том, маски и производные - исходной загрузки
+            nii_file.close()
+            await load_alias_metadata(file_orm.uuid, original.uuid, num_slices, str(file_orm.author_id),
+                                      file_orm.is_public)
+            api_logger.info(
+                "Duplicate upload linked to existing file",
+                extra={
+                    "file_uuid": str(file_orm.uuid),
+                    "storage_uuid": str(original.uuid),
+                    "file_name": filename,
+                    "request_id": request_id,
+                }
+            )
+            return file_orm
+
+        await load_files_redis(file_orm.uuid, image_volume, num_slices, str(file_orm.author_id), file_orm.is_public,
+                               spacing)
+        if derivatives:
+            # Контуры и PNG всех срезов считаются в фоне, пока пользователь открывает исследование;
+            # срезы берутся из Redis / дискового кэша окнами, том в памяти не держится
+            derivative_pipeline.start(file_orm.uuid, image_volume.shape[2], request_id)
 
+        # Дисковый кэш и S3 получают тот же LVOL-файл частями; файл удаляется после загрузки
         obj_name = f"files/{file_orm.uuid}.nii"
         await upload_files_to_s3(
             background_task,
             obj_name,
-            file_bytes,
-            image_volume,
+            nii_file,
+            file_orm.uuid,
+            processed_path,
             request_id,
         )
+        processed_path = None
 
         api_logger.info(
             "File uploaded successfully",
@@ -98,6 +166,9 @@ async def upload_file(
         return file_orm
 
     except Exception as e:
+        nii_file.close()
+        if processed_path:
+            os.unlink(processed_path)
         api_logger.error(
             "Failed to upload file: %s", str(e),
             extra={"request_id": request_id},
@@ -122,10 +193,11 @@ async def predict(
     user_id = getattr(request.state, "user_id", None)
 
     metadata = await get_metadata(file_uuid)
+    data_uuid = await resolve_storage(file_uuid, metadata, session)
 
     if metadata:
         if metadata['is_public'] == True or metadata['author_id'] == user_id:
-            if result_img := await get_result_cached(file_uuid, predict_request.num_images):
+            if result_img := await get_result_cached(data_uuid, predict_request.num_images):
                 api_logger.info(
                     "Prediction result served from Redis cache",
                     extra={
@@ -133,26 +205,26 @@ async def predict(
                         "request_id": request_id,
                     }
                 )
+                prefetcher.schedule(data_uuid, predict_request.num_images, ('contours', 'result'))
                 return Response(content=result_img, media_type="image/png")
 
         else:
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail={'msg': 'Forbidden file not is_public',
                                                                                "request_id": request_id})
 
-    file_bytes = await get_file_bytes(background_task=background_task, file_uuid=file_uuid,
-                                      session=session, request_id=request_id,
-                                      num_images=predict_request.num_images, user_id=user_id,
-                                      metadata=metadata)
+    image_slice = await get_file_slice(background_task=background_task, file_uuid=file_uuid,
+                                       session=session, request_id=request_id,
+                                       num_images=predict_request.num_images, user_id=user_id,
+                                       metadata=metadata)
 
-    img = modelManager.pred_image(file_bytes, predict_request.num_images)
-    contours = await get_contours_cached(file_uuid, predict_request.num_images)
-    if contours is None:
-        contours = modelManager.get_result_contours(img)
-        background_task.add_task(load_contours_cached, file_uuid, predict_request.num_images, contours)
+    img = await asyncio.to_thread(modelManager.pred_slice, image_slice)
 
-    result_img = modelManager.create_photo_with_contours(img, contours)
+    async def load_image():
+        return img
 
-    background_task.add_task(load_result_cached, file_uuid, predict_request.num_images, result_img)
+    contours = await get_slice_contours(data_uuid, predict_request.num_images, load_image, request_id)
+    result_img = await get_slice_result(data_uuid, predict_request.num_images, img, contours, request_id)
+    prefetcher.schedule(data_uuid, predict_request.num_images, ('contours', 'result'))
 
     api_logger.info(
         "Prediction completed successfully",
@@ -162,3 +234,81 @@ async def predict(
         }
     )
     return Response(content=result_img, media_type="image/png")
+
+
+@router.post('/files/{file_uuid}/segment-volume', response_model=SegmentVolume)
+async def segment_volume(
+        request: Request,
+        background_task: BackgroundTasks,
+        file_uuid: UUID4,
+        batch_size: int | None = Query(None, gt=0),
+        session: AsyncSession = Depends(get_async_session),
+) -> SegmentVolume:
+    request_id = request.state.request_id
+    file_uuid = str(file_uuid)
+    user_id = getattr(request.state, "user_id", None)
+    batch_size = batch_size or settings.SEGMENT_BATCH_SIZE
+
+    metadata = await get_metadata(file_uuid)
+    data_uuid = await resolve_storage(file_uuid, metadata, session)
+    file_bytes = await get_file_bytes(background_task=background_task, file_uuid=file_uuid,
+                                      session=session, request_id=request_id,
+                                      user_id=str(user_id) if user_id else '', metadata=metadata)
+
+    masks, contours_volume = await inference_executor.run(modelManager.segment_volume, file_bytes, batch_size,
+                                                          request_id=request_id)
+    await load_contours_volume_cached(data_uuid, contours_volume)
+    background_task.add_task(upload_mask_volume, data_uuid, await asyncio.to_thread(pack_masks, masks), request_id)
+
+    api_logger.info(
+        "Volume segmentation completed successfully",
+        extra={
+            "file_uuid": file_uuid,
+            "num_slices": len(contours_volume),
+            "batch_size": batch_size,
+            "request_id": request_id,
+        }
+    )
+    return SegmentVolume(uuid_file=file_uuid, num_slices=len(contours_volume), batch_size=batch_size)
+
+
+@router.get('/files/{file_uuid}/mask-stats')
+async def mask_stats(
+        request: Request,
+        file_uuid: UUID4,
+        session: AsyncSession = Depends(get_async_session),
+) -> dict:
+    request_id = request.state.request_id
+    user_id = getattr(request.state, "user_id", None)
+
+    metadata = await get_metadata(file_uuid)
+    await check_file_access(session, file_uuid, metadata, str(user_id) if user_id else '', request_id)
+
+    data_uuid = await resolve_storage(file_uuid, metadata, session)
+    packed = await get_mask_volume(data_uuid, request_id)
+    if packed is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail={"msg": "Volume is not segmented yet, call segment-volume first",
+                                    "request_id": request_id})
+    return await inference_executor.run(lambda: mask_statistics(unpack_masks(packed)), request_id=request_id)
+
+
+@router.get('/files/{file_uuid}/derivatives', response_model=DerivativesProgress)
+async def derivatives_progress(
+        request: Request,
+        file_uuid: UUID4,
+        session: AsyncSession = Depends(get_async_session),
+) -> DerivativesProgress:
+    request_id = request.state.request_id
+    user_id = getattr(request.state, "user_id", None)
+
+    metadata = await get_metadata(file_uuid)
+    await check_file_access(session, file_uuid, metadata, str(user_id) if user_id else '', request_id)
+
+    data_uuid = await resolve_storage(file_uuid, metadata, session)
+    progress = await get_derivatives_progress(data_uuid)
+    if progress is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail={"msg": "Derivatives were not requested for this file",
+                                    "request_id": request_id})
+    return DerivativesProgress(uuid_file=file_uuid, **progress)
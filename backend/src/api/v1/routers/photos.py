@@ -1,7 +1,13 @@
-from fastapi import APIRouter, Request, BackgroundTasks, Depends, HTTPException, status, Response, Path
+import asyncio
+import base64
+import json
+
+from fastapi import APIRouter, Request, BackgroundTasks, Depends, HTTPException, status, Response, Path, Query
 from pydantic import UUID4, BaseModel
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from src.config import settings
+from src.service.contour_codec import MEDIA_TYPE, accepts_binary, encode_contours, encode_contours_many
 from src.db.db import get_async_session
 from src.db.manager_files import fileManager
 from src.db.manager_photos import photos_manager
@@ -9,14 +15,36 @@ from src.logger import api_logger, database_logger
 from src.schemas.photos import PhotoCreate
 from src.schemas.users import UserPhoto
 from src.service.model import modelManager
-from src.service.redis_conn import get_metadata, get_contours_cached, load_contours_cached, \
-    load_clear_photo, get_clear_photo_cached
-from src.utils.file import get_file_bytes
+from src.service.inference import inference_executor
+from src.service.prefetch import prefetcher
+from src.service.redis_conn import get_metadata, load_clear_photo, get_clear_photo_cached
+from src.utils.file import get_file_slice, get_file_slices, resolve_storage, check_file_access
 from src.utils.s3_jobs import create_add_photo_s3
+from src.utils.derivatives import get_slice_contours, get_range_contours, get_range_photos
+
+def contours_response(request: Request, contours):
+    """Контуры среза: LCNT, если клиент просит его в Accept, иначе JSON."""
+    if accepts_binary(request.headers.get('accept')):
+        return Response(content=encode_contours(contours), media_type=MEDIA_TYPE)
+    return Response(content=json.dumps(contours), media_type="application/json")
+
 
 router = APIRouter(prefix='/photos')
 
 
+async def check_file(request, session, file_uuid, num_slice):
+    """
+    Доступ к файлу и номер среза - до кэша и prefetch: по метаданным в Redis, иначе по БД.
+    :return: (метаданные или None, uuid данных файла, user_id)
+    """
+    request_id = request.state.request_id
+    user_id = getattr(request.state, "user_id", None)
+    user_id = str(user_id) if user_id else ''
+    metadata = await get_metadata(file_uuid)
+    await check_file_access(session, file_uuid, metadata, user_id, request_id, num_slice)
+    return metadata, await resolve_storage(file_uuid, metadata, session), user_id
+
+
 @router.post('/save')
 async def saved_photos(
         request: Request,
@@ -86,15 +114,17 @@ async def get_file_photo(background_task: BackgroundTasks, file_uuid: UUID4, req
                          session=Depends(get_async_session)):
     request_id = request.state.request_id
     try:
-        if img := await get_clear_photo_cached(file_uuid, num_slices):
+        metadata, data_uuid, user_id = await check_file(request, session, file_uuid, num_slices)
+        prefetcher.schedule(data_uuid, num_slices, ('img',))
+        if img := await get_clear_photo_cached(data_uuid, num_slices):
             return Response(content=img, media_type="image/png")
 
-        file_bytes = await get_file_bytes(background_task=background_task, file_uuid=file_uuid, session=session,
-                                          request_id=request_id,
-                                          num_images=num_slices)
-        image = modelManager.pred_image(file_bytes, num_slices)
-        img = modelManager.get_photo(image)
-        background_task.add_task(load_clear_photo, file_uuid, num_slices, img)
+        image_slice = await get_file_slice(background_task=background_task, file_uuid=file_uuid, session=session,
+                                           request_id=request_id,
+                                           num_images=num_slices, user_id=user_id, metadata=metadata)
+        image = await asyncio.to_thread(modelManager.pred_slice, image_slice)
+        img = await inference_executor.run(modelManager.get_photo, image, request_id=request_id)
+        background_task.add_task(load_clear_photo, data_uuid, num_slices, img)
 
         return Response(content=img, media_type="image/png")
     except HTTPException:
@@ -118,17 +148,16 @@ async def get_file_photo(background_task: BackgroundTasks, file_uuid: UUID4, req
                          session=Depends(get_async_session)):
     request_id = request.state.request_id
     try:
-        if con := await get_contours_cached(file_uuid, num_slices):
-            return con
-        else:
-
-            file_bytes = await get_file_bytes(background_task=background_task, file_uuid=file_uuid, session=session,
-                                              request_id=request_id,
-                                              num_images=num_slices)
-            image = modelManager.pred_image(file_bytes, num_slices)
-            con = modelManager.get_result_contours(image)
-            background_task.add_task(load_contours_cached, file_uuid, num_slices, con)
-            return con
+        metadata, data_uuid, user_id = await check_file(request, session, file_uuid, num_slices)
+        prefetcher.schedule(data_uuid, num_slices, ('contours',))
+
+        async def load_image():
+            image_slice = await get_file_slice(background_task=background_task, file_uuid=file_uuid,
+                                               session=session, request_id=request_id,
+                                               num_images=num_slices, user_id=user_id, metadata=metadata)
+            return await asyncio.to_thread(modelManager.pred_slice, image_slice)
+
+        return contours_response(request, await get_slice_contours(data_uuid, num_slices, load_image, request_id))
     except HTTPException as e:
         api_logger.warning(
             "Failed get_file_photo ",
@@ -148,3 +177,54 @@ async def get_file_photo(background_task: BackgroundTasks, file_uuid: UUID4, req
             exc_info=e,
         )
         raise HTTPException(500, detail={'msg': "Failed get_file_photo"})
+
+
+async def check_range(request, session, file_uuid, start, stop):
+    """
+    Проверка диапазона срезов [start, stop] и доступа к файлу.
+    :return: (uuid данных файла, async-функция загрузки срезов [a, b))
+    """
+    request_id = request.state.request_id
+    if stop < start or stop - start + 1 > settings.RANGE_MAX_SLICES:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail={"msg": f"Expected from <= to and at most {settings.RANGE_MAX_SLICES} slices",
+                                    "request_id": request_id})
+    metadata, data_uuid, user_id = await check_file(request, session, file_uuid, stop)
+
+    async def load_slices(a, b):
+        return await get_file_slices(file_uuid, session, request_id, a, b, user_id, metadata)
+
+    return data_uuid, load_slices
+
+
+@router.get('/{file_uuid}/contours')
+async def get_contours_range(file_uuid: UUID4, request: Request,
+                             start: int = Query(..., alias='from', ge=0),
+                             stop: int = Query(..., alias='to', ge=0),
+                             session=Depends(get_async_session)):
+    """
+    Контуры срезов from..to (включительно) одним запросом; contours[i] - срез from + i.
+    С Accept: application/x-lcnt - блоки LCNT по срезам (encode_contours_many).
+    """
+    request_id = request.state.request_id
+    data_uuid, load_slices = await check_range(request, session, file_uuid, start, stop)
+    contours = await get_range_contours(data_uuid, start, stop + 1, load_slices, request_id)
+    if accepts_binary(request.headers.get('accept')):
+        return Response(content=encode_contours_many([encode_contours(item) for item in contours]),
+                        media_type=MEDIA_TYPE)
+    return Response(content=json.dumps({'from': start, 'to': stop, 'contours': contours}),
+                    media_type="application/json")
+
+
+@router.get('/{file_uuid}/photos')
+async def get_photos_range(file_uuid: UUID4, request: Request,
+                           start: int = Query(..., alias='from', ge=0),
+                           stop: int = Query(..., alias='to', ge=0),
+                           session=Depends(get_async_session)):
+    """PNG срезов from..to (включительно) одним запросом, base64; images[i] - срез from + i."""
+    request_id = request.state.request_id
+    data_uuid, load_slices = await check_range(request, session, file_uuid, start, stop)
+    photos = await get_range_photos(data_uuid, start, stop + 1, load_slices, request_id)
+    return Response(content=json.dumps({'from': start, 'to': stop,
+                                        'images': [base64.b64encode(photo).decode() for photo in photos]}),
+                    media_type="application/json")
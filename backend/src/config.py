@@ -28,11 +28,69 @@ class Settings(BaseSettings):
     S3_ENDPOINTPUT: str
     S3_REGION: str
     S3_PRIVATE_BUCKET_NAME: str
+    S3_MULTIPART_THRESHOLD: int = 16 * 1024 * 1024  # больше - multipart upload
+    S3_MULTIPART_PART_SIZE: int = 8 * 1024 * 1024  # не меньше 5 MB (ограничение S3)
+    S3_MULTIPART_CONCURRENCY: int = 4
+    S3_MAX_POOL_CONNECTIONS: int = 32
+    S3_KEEPALIVE_TIMEOUT: int = 60  # секунды простоя соединения в пуле
+    S3_CONNECT_TIMEOUT: int = 5
+    S3_READ_TIMEOUT: int = 60
+    S3_MAX_ATTEMPTS: int = 5
+    S3_RETRY_MODE: str = 'adaptive'  # legacy | standard | adaptive
 
     REDIS_USER_PASSWORD: str
     REDIS_HOST: str = "localhost"
     REDIS_PORT: int = 6379
-    REDIS_EXP: int
+    REDIS_EXP: int  # TTL томов и метаданных файлов
+    REDIS_TTL_IMG: int = 60 * 30
+    REDIS_TTL_RESULT: int = 60 * 30
+    REDIS_TTL_CONTOURS: int = 60 * 30
+    REDIS_TTL_MASK: int = 60 * 30
+    REDIS_TTL_DERIVATIVES: int = 60 * 30
+    REDIS_TTL_JITTER: float = 0.1  # TTL * (1 + U(0, jitter)), чтобы записанные вместе ключи не истекали разом
+    REDIS_TOUCH_INTERVAL: int = 60  # как часто продлевать TTL читаемого тома (на процесс)
+    REDIS_EARLY_REFRESH_S: int = 60  # окно вероятностного раннего продления производных
+    KEYSPACE_STATS_INTERVAL: int = 300  # пересчёт снимка /cache/keyspaces в фоне, 0 - выключен
+    KEYSPACE_STATS_SAMPLE: int = 50
+    VOLUME_CHUNK_SLICES: int = 8
+    VOLUME_STORAGE_DTYPE: str = 'float32'  # float32 | float16 | uint16
+    DISK_CACHE_DIR: str = ''  # пусто - дисковый кэш выключен, например /var/cache/liver-ct
+    DISK_CACHE_MAX_BYTES: int = 20 * 1024 ** 3
+    LOCAL_CACHE_MAX_BYTES: int = 256 * 1024 * 1024  # 0 - L1-кэш в памяти процесса выключен
+    LOCAL_CACHE_TTL: int = 60
+
+    UPLOAD_SPOOL_MAX_BYTES: int = 16 * 1024 * 1024  # больше - временный файл на диске
+    UPLOAD_DECODE_BUDGET_BYTES: int = 64 * 1024 * 1024  # память на кусок срезов при декодировании
+    UPLOAD_MAX_CONCURRENT: int = 2
+    UPLOAD_TMP_DIR: str = ''  # временные LVOL обработанных томов, пусто - системный tmp
+
+    SEGMENT_BATCH_SIZE: int = 8
+    DERIVATIVES_ON_UPLOAD: bool = False  # по умолчанию для /upload?derivatives=
+    DERIVATIVES_CONCURRENCY: int = 2
+    DERIVATIVES_MAX_FILES: int = 1
+    INFERENCE_WORKERS: int = 2
+    INFERENCE_QUEUE_SIZE: int = 16
+    INFERENCE_LOW_PRIORITY_WORKERS: int = 1  # отдельная полоса для фоновых задач (prefetch)
+    BATCH_MAX_SIZE: int = 8
+    BATCH_MAX_WAIT_MS: int = 10
+    BATCH_QUEUE_SIZE: int = 64  # срезов в ожидании батча, больше - 503
+    MODEL_BACKEND: str = 'eager'  # eager | torchscript | onnx | onnx-int8
+    INFERENCE_REPLICAS: int = 0  # 0 - модель в процессе API, иначе число процессов-реплик
+    REPLICA_THREADS: int = 4
+    REPLICA_INTEROP_THREADS: int = 1
+    REPLICA_PIN_CORES: bool = False
+
+    RANGE_MAX_SLICES: int = 128  # максимум срезов в одном запросе ?from=&to=
+
+    PREFETCH_DEPTH: int = 2  # 0 - предрасчёт соседних срезов выключен
+    PREFETCH_FILE_BUDGET: int = 64
+    PREFETCH_QUEUE_SIZE: int = 32
+
+    RENDER_PNG_COMPRESSION: int = 1  # 0-9, zlib
+
+    SINGLE_FLIGHT_LEASE_MS: int = 10000  # lease на расчёт одного ключа между воркерами
+    SINGLE_FLIGHT_WAIT_S: float = 15
+    SINGLE_FLIGHT_POLL_MS: int = 50
 
     auth_jwt: AuthJWT = AuthJWT()
 
@@ -4,9 +4,14 @@ from typing import AsyncGenerator
 from fastapi import FastAPI
 
 from src.config import settings
-from src.service.redis_conn import redis_client
+from src.service.redis_conn import redis_client, keyspace_stats_cache
 from src.service.s3 import s3_client
+from src.service.disk_cache import disk_cache
 from src.service.model import modelManager
+from src.service.inference import inference_executor
+from src.service.batcher import segmentation_batcher
+from src.service.prefetch import prefetcher
+from src.utils.derivatives import derivative_pipeline
 
 
 @asynccontextmanager
@@ -16,11 +21,29 @@ async def lifespan(app: FastAPI) -> AsyncGenerator[None, None]:
         secret_key=settings.S3_SECRET_KEY,
         endpoint_url=settings.S3_ENDPOINTPUT,
         region_name=settings.S3_REGION,
+        max_pool_connections=settings.S3_MAX_POOL_CONNECTIONS,
+        keepalive_timeout=settings.S3_KEEPALIVE_TIMEOUT,
+        connect_timeout=settings.S3_CONNECT_TIMEOUT,
+        read_timeout=settings.S3_READ_TIMEOUT,
+        max_attempts=settings.S3_MAX_ATTEMPTS,
+        retry_mode=settings.S3_RETRY_MODE,
     )
     await redis_client.connect()
-    modelManager.upload_model()
+    disk_cache.open(settings.DISK_CACHE_DIR, settings.DISK_CACHE_MAX_BYTES)
+    if not settings.INFERENCE_REPLICAS:
+        modelManager.upload_model(settings.MODEL_BACKEND)
+    inference_executor.start()
+    segmentation_batcher.start()
+    prefetcher.start()
+    keyspace_stats_cache.start()
     yield
+    await keyspace_stats_cache.stop()
+    await derivative_pipeline.stop()
+    await prefetcher.stop()
+    await segmentation_batcher.stop()
+    inference_executor.shutdown()
     await redis_client.close()
+    await s3_client.close()
 
 
 def create_app() -> FastAPI:
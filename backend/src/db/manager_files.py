@@ -1,4 +1,5 @@
 from fastapi import HTTPException, status
+from sqlalchemy import select
 
 from src.db.base import BaseManager
 from src.logger import database_logger
@@ -127,5 +128,56 @@ class FileManager(BaseManager):
                             "request_id": request_id}
             )
 
+    async def get_by_hash(
+            self,
+            session,
+            content_hash,
+            request_id
+    ) -> Files | None:
+        """Исходная (не дубликат) загрузка с тем же содержимым, если есть."""
+        try:
+            result = await session.execute(
+                select(Files)
+                .where(Files.content_hash == content_hash,
+                       Files.storage_uuid.is_(None),
+                       Files.delete_at.is_(None))
+                .order_by(Files.create_at)
+                .limit(1)
+            )
+            return result.scalar_one_or_none()
+        except Exception as e:
+            database_logger.error(
+                "Failed to look up file by content hash",
+                exc_info=e,
+                extra={
+                    "content_hash": content_hash,
+                    "request_id": request_id,
+                    "error": str(e),
+                }
+            )
+            # Без дедупликации загрузка всё равно пройдёт
+            return None
+
+    async def get_storage(
+            self,
+            session,
+            file_db
+    ) -> Files:
+        """Строка, чьи объекты в S3 и кэше использует file_db: она сама или исходная загрузка."""
+        if file_db.storage_uuid is None:
+            return file_db
+        return await session.get(Files, file_db.storage_uuid)
+
+    async def get_storage_uuid(
+            self,
+            session,
+            file_uuid
+    ) -> str:
+        """uuid данных файла по БД (для холодного дубликата без метаданных в Redis); нет строки - свой uuid."""
+        file_db = await session.get(Files, file_uuid)
+        if file_db is None:
+            return str(file_uuid)
+        return str((await self.get_storage(session, file_db)).uuid)
+
 
 fileManager = FileManager()
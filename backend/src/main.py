@@ -2,6 +2,7 @@ from starlette.middleware.cors import CORSMiddleware
 
 from src.create_app import create_app
 from src.api.v1 import router
+from src.api.metrics import router as metrics_router
 from src.middlewares.authmiddleware import AuthMiddleware
 from src.middlewares.logmiddleware import LogExecutionTimeMiddleware
 
@@ -18,6 +19,7 @@ origins = [
     "http://192.168.65.1:3000"
 ]
 app.include_router(router, tags=['API model'])
+app.include_router(metrics_router)
 
 app.add_middleware(AuthMiddleware)
 app.add_middleware(LogExecutionTimeMiddleware)
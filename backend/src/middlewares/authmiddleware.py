@@ -12,7 +12,7 @@ class AuthMiddleware(BaseHTTPMiddleware):
             return await call_next(request)
 
         if (any(request.url.path.endswith(end) for end in ("/docs", "/openapi.json",))
-                or "/auth/" in request.url.path):
+                or "/auth/" in request.url.path or request.url.path == '/metrics'):
             return await call_next(request)
 
         response_401 = JSONResponse(
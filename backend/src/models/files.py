@@ -15,6 +15,10 @@ class Files(Base):
     author_id: Mapped[UUID | None] = mapped_column(UUID(as_uuid=True), ForeignKey('users.uuid'), nullable=True,
                                                    default=None)
     is_public: Mapped[bool] = mapped_column(nullable=False, default=False)
+    # sha256 несжатого .nii; storage_uuid - файл, чьи объекты в S3/кэше использует дубликат (None - свои)
+    content_hash: Mapped[str | None] = mapped_column(String(64), nullable=True, index=True, default=None)
+    storage_uuid: Mapped[UUID | None] = mapped_column(UUID(as_uuid=True), ForeignKey('files.uuid'), nullable=True,
+                                                      default=None)
 
     author: Mapped["Users"] = relationship(back_populates='files', lazy="select")
     saved_photos_file: Mapped[list['Photos']] = relationship(back_populates='file', lazy="select")
@@ -3,4 +3,17 @@ from pydantic import BaseModel, Field, UUID4
 
 class Predict(BaseModel):
     uuid_file: UUID4
-    num_images: int = Field(..., ge=0)
\ No newline at end of file
+    num_images: int = Field(..., ge=0)
+
+
+class SegmentVolume(BaseModel):
+    uuid_file: UUID4
+    num_slices: int = Field(..., ge=0)
+    batch_size: int = Field(..., gt=0)
+
+
+class DerivativesProgress(BaseModel):
+    uuid_file: UUID4
+    status: str
+    done: int = Field(..., ge=0)
+    total: int = Field(..., ge=0)
@@ -0,0 +1,124 @@
+import numpy as np
+import torch
+import segmentation_models_pytorch as smp
+
+MODEL_PATHS = {
+    'eager': 'model.pth',
+    'torchscript': 'model.ts',
+    'onnx': 'model.onnx',
+    'onnx-int8': 'model.int8.onnx',
+}
+INPUT_SHAPE = (1, 1, 256, 256)
+
+
+class OnnxBackend:
+    """Обёртка над onnxruntime с тем же интерфейсом, что и у torch-модели: тензор -> логиты."""
+
+    def __init__(self, path, device, num_threads=0, interop_threads=0):
+        try:
+            import onnxruntime as ort
+        except ImportError:
+            raise RuntimeError("onnxruntime is not installed")
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        # 0 - по умолчанию onnxruntime (все ядра); у реплик - их доля ядер, как у torch
+        options.intra_op_num_threads = num_threads
+        options.inter_op_num_threads = interop_threads
+        providers = ['CPUExecutionProvider']
+        if device.type == 'cuda':
+            providers.insert(0, 'CUDAExecutionProvider')
+
+        self.device = device
+        self.session = ort.InferenceSession(path, sess_options=options, providers=providers)
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, images: torch.Tensor) -> torch.Tensor:
+        images = np.ascontiguousarray(images.detach().cpu().numpy(), dtype=np.float32)
+        logits = self.session.run(None, {self.input_name: images})[0]
+        return torch.from_numpy(logits).to(self.device)
+
+
+def load_eager(n_cls, device, path=MODEL_PATHS['eager']):
+    model = smp.DeepLabV3Plus(classes=n_cls, in_channels=1)
+    try:
+        model.load_state_dict(torch.load(path, map_location=device))
+    except FileNotFoundError:
+        raise RuntimeError("Model file not found")
+    model.to(device)
+    model.eval()
+    return model
+
+
+def load_torchscript(n_cls, device, path=MODEL_PATHS['torchscript']):
+    try:
+        model = torch.jit.load(path, map_location=device)
+    except ValueError:
+        raise RuntimeError("TorchScript model file not found, run `python -m scripts.export_model`")
+    model.eval()
+    return model
+
+
+def load_onnx(n_cls, device, path=MODEL_PATHS['onnx'], num_threads=0, interop_threads=0):
+    try:
+        return OnnxBackend(path, device, num_threads, interop_threads)
+    except RuntimeError:
+        raise
+    except Exception as e:
+        raise RuntimeError(f"ONNX model could not be loaded ({e}), run `python -m scripts.export_model`")
+
+
+def load_onnx_int8(n_cls, device, path=MODEL_PATHS['onnx-int8'], num_threads=0, interop_threads=0):
+    try:
+        return OnnxBackend(path, torch.device('cpu'), num_threads, interop_threads)
+    except RuntimeError:
+        raise
+    except Exception as e:
+        raise RuntimeError(f"INT8 model could not be loaded ({e}), run `python -m scripts.quantize_model`")
+
+
+BACKENDS = {
+    'eager': load_eager,
+    'torchscript': load_torchscript,
+    'onnx': load_onnx,
+    'onnx-int8': load_onnx_int8,
+}
+ONNX_BACKENDS = ('onnx', 'onnx-int8')
+
+
+def load_backend(name, n_cls, device, num_threads=0, interop_threads=0):
+    """num_threads / interop_threads - потоки onnxruntime (0 - по умолчанию); torch настраивается глобально."""
+    if name not in BACKENDS:
+        raise RuntimeError(f"Unknown model backend '{name}', expected one of {list(BACKENDS)}")
+    if name in ONNX_BACKENDS:
+        return BACKENDS[name](n_cls, device, num_threads=num_threads, interop_threads=interop_threads)
+    return BACKENDS[name](n_cls, device)
+
+
+def export_torchscript(model, path=MODEL_PATHS['torchscript']):
+    example = torch.rand(INPUT_SHAPE)
+    with torch.no_grad():
+        traced = torch.jit.trace(model.cpu(), example)
+    traced.save(path)
+    return path
+
+
+def export_onnx(model, path=MODEL_PATHS['onnx']):
+    example = torch.rand(INPUT_SHAPE)
+    torch.onnx.export(
+        model.cpu(), example, path,
+        input_names=['image'], output_names=['logits'],
+        dynamic_axes={'image': {0: 'batch'}, 'logits': {0: 'batch'}},
+        opset_version=17,
+    )
+    return path
+
+
+def compare_backends(reference, backend, batch_size=4, seed=0):
+    """Максимальное расхождение логитов backend относительно эталонной eager-модели на случайном батче."""
+    generator = torch.Generator().manual_seed(seed)
+    images = torch.rand((batch_size, *INPUT_SHAPE[1:]), generator=generator)
+    with torch.no_grad():
+        expected = reference(images).cpu()
+        actual = backend(images).cpu()
+    return (expected - actual).abs().max().item()
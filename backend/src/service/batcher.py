@@ -0,0 +1,113 @@
+import asyncio
+import time
+
+import torch
+
+from src.config import settings
+from src.logger import api_logger
+from src.service.inference import inference_executor, server_busy
+from src.service.model import modelManager
+
+
+class MicroBatcher:
+    """
+    Собирает одновременные запросы на сегментацию срезов (из любых файлов
+    и от любых пользователей) в один батч и раздаёт результаты обратно.
+    Батч уходит в модель, когда набрано max_batch_size срезов
+    или истекло max_wait_ms с момента первого запроса в батче.
+    Очередь ограничена queue_size срезами: при переполнении - тот же 503, что и у inference_executor.
+    """
+
+    def __init__(self, max_batch_size: int = settings.BATCH_MAX_SIZE,
+                 max_wait_ms: int = settings.BATCH_MAX_WAIT_MS,
+                 queue_size: int = settings.BATCH_QUEUE_SIZE):
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.queue_size = queue_size
+        self._queue: asyncio.Queue | None = None
+        self._worker: asyncio.Task | None = None
+        self._running: set[asyncio.Task] = set()
+
+    def start(self):
+        if self._worker is None:
+            self._queue = asyncio.Queue(maxsize=self.queue_size)
+            self._worker = asyncio.create_task(self._collect())
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        if self._running:
+            await asyncio.gather(*self._running, return_exceptions=True)
+
+    @property
+    def idle(self) -> bool:
+        return (self._queue is None or self._queue.empty()) and not self._running
+
+    async def submit(self, image: torch.Tensor, request_id=None):
+        """
+        :param image: тензор одного среза (1 x 1 x H x W), как из pred_image
+        :return: список контуров среза
+        """
+        if self._worker is None:
+            self.start()
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait((image, future, request_id))
+        except asyncio.QueueFull:
+            api_logger.warning(
+                "Batch queue is full",
+                extra={"queued": self._queue.qsize(), "request_id": request_id}
+            )
+            raise server_busy(request_id)
+        return await future
+
+    async def _collect(self):
+        while True:
+            batch = [await self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            # Следующий батч собираем, не дожидаясь окончания текущего
+            task = asyncio.create_task(self._run_batch(batch))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    @staticmethod
+    async def _run_batch(batch):
+        batch = [item for item in batch if not item[1].cancelled()]
+        if not batch:
+            return
+
+        images = torch.cat([image for image, _, _ in batch], dim=0)
+        try:
+            results = await inference_executor.run(modelManager.get_result_contours_batch, images,
+                                                   request_id=batch[0][2])
+        except Exception as e:
+            api_logger.warning(
+                "Batch inference failed",
+                extra={"batch_size": len(batch), "error": str(e)}
+            )
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future, _), contours in zip(batch, results):
+            if not future.done():
+                future.set_result(contours)
+
+
+segmentation_batcher = MicroBatcher()
@@ -0,0 +1,129 @@
+import struct
+
+import numpy as np
+
+# Компактный бинарный формат контуров одного среза (вместо JSON вложенных float-списков):
+#   заголовок: magic, version, flags, scale, число контуров
+#   + длины контуров (uint32) + первые точки (int32 x, y)
+#   + приращения остальных точек относительно предыдущей (int16, при переполнении int32).
+# Координаты в фиксированной точке: value * scale; для контуров модели (целые пиксели) scale = 1
+# и кодирование без потерь, для дробных (ручные контуры) - с точностью 1 / FIXED_POINT_SCALE пикселя.
+MAGIC = b'LCNT'
+VERSION = 1
+HEADER = struct.Struct('<4sBBHI')
+FLAG_WIDE = 1
+FIXED_POINT_SCALE = 256
+MEDIA_TYPE = 'application/x-lcnt'
+
+# Несколько срезов в одном ответе: число срезов (uint32), длины (uint32), блоки подряд
+MANY = struct.Struct('<I')
+
+
+def is_contours(data) -> bool:
+    return bytes(data[:4]) == MAGIC
+
+
+def accepts_binary(accept: str | None) -> bool:
+    """Content negotiation: клиент явно попросил бинарный формат в Accept."""
+    return bool(accept) and MEDIA_TYPE in accept
+
+
+def encode_contours(contours) -> bytes:
+    """[[[x, y], ...], ...] (или плоские [x, y, x, y, ...]) -> LCNT."""
+    arrays = [np.asarray(contour, dtype=np.float64).reshape(-1, 2) for contour in contours]
+    lengths = np.array([len(points) for points in arrays], dtype='<u4')
+    points = np.concatenate(arrays) if arrays else np.empty((0, 2))
+
+    scale = 1 if np.array_equal(points, np.rint(points)) else FIXED_POINT_SCALE
+    fixed = np.rint(points * scale)
+    if fixed.size and not np.all(np.abs(fixed) < 2 ** 31):
+        raise ValueError("Contour coordinates out of range")
+    fixed = fixed.astype(np.int64)
+
+    first = _first_points(lengths)
+    starts = np.zeros((len(lengths), 2), dtype='<i4')
+    starts[lengths > 0] = fixed[first]
+    deltas = fixed.copy()
+    deltas[1:] -= fixed[:-1]
+    is_first = np.zeros(len(fixed), dtype=bool)
+    is_first[first] = True
+    deltas = deltas[~is_first]
+
+    flags = 0
+    if deltas.size and np.abs(deltas).max() > np.iinfo(np.int16).max:
+        flags |= FLAG_WIDE
+    deltas = deltas.astype('<i4' if flags & FLAG_WIDE else '<i2')
+    header = HEADER.pack(MAGIC, VERSION, flags, scale, len(lengths))
+    return header + lengths.tobytes() + starts.tobytes() + deltas.tobytes()
+
+
+def decode_contours(data) -> list[list[list[float]]]:
+    """LCNT -> [[[x, y], ...], ...] как у mask_to_polygons."""
+    if len(data) < HEADER.size:
+        raise ValueError("Not a contours blob")
+    magic, version, flags, scale, count = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION or scale == 0:
+        raise ValueError("Not a contours blob")
+    offset = HEADER.size
+    lengths = np.frombuffer(data, dtype='<u4', count=count, offset=offset).astype(np.int64)
+    offset += count * 4
+    starts = np.frombuffer(data, dtype='<i4', count=count * 2, offset=offset).reshape(-1, 2)
+    offset += starts.nbytes
+
+    nonempty = lengths > 0
+    total = int(lengths.sum())
+    dtype = np.dtype('<i4' if flags & FLAG_WIDE else '<i2')
+    num_deltas = total - int(np.count_nonzero(nonempty))
+    if len(data) != offset + num_deltas * 2 * dtype.itemsize:
+        raise ValueError("Corrupted contours blob")
+    deltas = np.frombuffer(data, dtype=dtype, count=num_deltas * 2, offset=offset).reshape(-1, 2)
+
+    # Сумма приращений по всем точкам подряд, затем сдвиг каждого контура к его первой точке
+    first = _first_points(lengths)
+    steps = np.empty((total, 2), dtype=np.int64)
+    is_first = np.zeros(total, dtype=bool)
+    is_first[first] = True
+    steps[is_first] = starts[nonempty]
+    steps[~is_first] = deltas
+    points = np.cumsum(steps, axis=0)
+    points -= np.repeat(points[first] - starts[nonempty], lengths[nonempty], axis=0)
+
+    points = (points / scale).tolist()
+    bounds = np.concatenate([[0], np.cumsum(lengths)]).tolist()
+    return [points[bounds[i]:bounds[i + 1]] for i in range(count)]
+
+
+def encode_contours_many(blobs: list[bytes]) -> bytes:
+    """Несколько LCNT (срезы диапазона) в одном теле ответа."""
+    lengths = np.array([len(blob) for blob in blobs], dtype='<u4')
+    return MANY.pack(len(blobs)) + lengths.tobytes() + b''.join(blobs)
+
+
+def check_points(points) -> list:
+    """
+    Быстрая проверка ручных контуров вместо вложенной pydantic-модели:
+    список контуров, каждый - [[x, y], ...] или плоский [x, y, ...] чётной длины из конечных чисел.
+    Возвращает те же контуры, приведённые к float (строки вроде "1" дальше не проходят).
+    """
+    if not isinstance(points, list):
+        raise ValueError("points must be a list")
+    result = []
+    for contour in points:
+        if not isinstance(contour, list):
+            raise ValueError("Each contour must be a list")
+        try:
+            array = np.asarray(contour, dtype=np.float64)
+        except (TypeError, ValueError):
+            raise ValueError("Contour must contain only numbers or [x, y] points")
+        if array.ndim > 2 or not np.all(np.isfinite(array)):
+            raise ValueError("Contour must contain only numbers or [x, y] points")
+        if (array.ndim == 2 and array.shape[1] != 2) or (array.ndim == 1 and len(array) % 2):
+            raise ValueError("Contour points must be [x, y] pairs")
+        result.append(array.tolist())
+    return result
+
+
+def _first_points(lengths: np.ndarray) -> np.ndarray:
+    """Индексы первых точек непустых контуров в общем массиве точек."""
+    offsets = np.cumsum(lengths, dtype=np.int64) - lengths
+    return offsets[lengths > 0]
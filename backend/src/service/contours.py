@@ -0,0 +1,28 @@
+import cv2
+import numpy as np
+
+
+def mask_to_polygons(mask: np.ndarray) -> list[list[list[float]]]:
+    """
+    Бинарная маска (H x W) -> внешние контуры в формате [[[x, y], ...], ...].
+    Точки, уже встречавшиеся в предыдущих контурах (и повторы внутри контура
+    на участках толщиной в 1 пиксель), выкидываются, порядок обхода сохраняется.
+    """
+    mask = np.ascontiguousarray(mask, dtype=np.uint8)
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)
+    if not contours:
+        return []
+
+    points = np.concatenate(contours).reshape(-1, 2)
+    lengths = [len(contour) for contour in contours]
+
+    # Первое вхождение каждой точки по всем контурам сразу
+    _, first = np.unique(points, axis=0, return_index=True)
+    keep = np.zeros(len(points), dtype=bool)
+    keep[first] = True
+
+    polygons = []
+    for contour, contour_keep in zip(np.split(points, np.cumsum(lengths)[:-1]),
+                                     np.split(keep, np.cumsum(lengths)[:-1])):
+        polygons.append(contour[contour_keep].astype(np.float64).tolist())
+    return polygons
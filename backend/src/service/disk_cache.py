@@ -0,0 +1,356 @@
+import asyncio
+import fcntl
+import mmap
+import os
+import tempfile
+import threading
+import time
+import weakref
+import zlib
+from pathlib import Path
+
+import numpy as np
+
+from src.logger import api_logger
+from src.service.volume_format import (
+    HEADER_SIZE, LAYOUT_SLICES,
+    dump_volume, is_volume, load_volume, load_volume_any, read_header_layout, slice_range, load_slice,
+)
+
+SUFFIX = '.lvol'
+COPY_CHUNK = 8 * 1024 * 1024
+LOCK_NAME = '.evict.lock'
+# Незаконченные записи старше этого - остатки упавших процессов; свежие могут писаться другим воркером
+STALE_TMP_S = 60 * 60
+
+
+def _parse_name(name: str):
+    """{uuid}.{crc32}.lvol -> (uuid, crc32); None - чужой или недописанный файл."""
+    parts = name.split('.')
+    if len(parts) != 3 or f'.{parts[2]}' != SUFFIX:
+        return None
+    try:
+        return parts[0], int(parts[1], 16)
+    except ValueError:
+        return None
+
+
+class _Entry:
+    __slots__ = ('path', 'size', 'crc', 'mmap', 'checked', 'verified', 'verifying', 'readers', 'evicted')
+
+    def __init__(self, path: Path, size: int, crc: int, verified: bool = False):
+        self.path = path
+        self.size = size
+        self.crc = crc
+        self.mmap = None
+        self.checked = False  # заголовок и размер
+        self.verified = verified  # crc32 всего файла
+        self.verifying = False
+        self.readers = 0  # живые массивы поверх mmap и чтения в процессе
+        self.evicted = False
+
+
+class DiskCache:
+    """
+    Локальный дисковый кэш обработанных томов между Redis и S3.
+    Файл - LVOL с LAYOUT_SLICES, имя {uuid}.{crc32}.lvol; читается через mmap,
+    срез отдаётся без чтения остального тома.
+    Запись атомарная (временный файл + os.replace). При первом открытии в процессе проверяются
+    заголовок и размер, crc32 всего файла - в фоне; битый файл удаляется.
+    Каталог общий для всех воркеров, поэтому источник правды - сам каталог: файл, записанный другим
+    воркером, подхватывается при промахе, а вытеснение (LRU по mtime, его обновляет каждое чтение)
+    считает объём по скану каталога под файловым замком. mmap вытесненного файла (в том числе
+    удалённого другим воркером) закрывается, когда на него не остаётся читателей.
+    """
+
+    def __init__(self):
+        self.directory: Path | None = None
+        self.max_bytes = 0
+        self._entries: dict[str, _Entry] = {}
+        # RLock: _release может вызваться из weakref.finalize (сборка мусора) внутри секции под замком
+        self._lock = threading.RLock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.directory is not None
+
+    def open(self, directory: str, max_bytes: int):
+        """Пустой directory - кэш выключен. Уже лежащие файлы подхватываются в порядке mtime."""
+        if not directory or max_bytes <= 0:
+            return
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+
+        for path in self.directory.glob('*.tmp'):
+            try:
+                if path.stat().st_mtime < time.time() - STALE_TMP_S:
+                    path.unlink(missing_ok=True)
+            except OSError:
+                continue
+        files = self._evict()
+        print(f'✅ Disk cache: {len(files)} volumes, {sum(size for _, _, size in files) / 2 ** 30:.2f} GB')
+
+    def _scan(self) -> list[tuple[float, Path, int]]:
+        """[(mtime, путь, размер)] всех файлов кэша в каталоге - от всех воркеров."""
+        files = []
+        for path in self.directory.iterdir():
+            if _parse_name(path.name) is None:
+                continue
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            files.append((stat.st_mtime, path, stat.st_size))
+        return files
+
+    def _find(self, uuid: str) -> _Entry | None:
+        """Файл тома в каталоге (мог записать другой воркер), самый свежий."""
+        found = []
+        for path in self.directory.glob(f'{uuid}.*{SUFFIX}'):
+            parsed = _parse_name(path.name)
+            if parsed is None or parsed[0] != uuid:
+                continue
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            found.append((stat.st_mtime, path, stat.st_size, parsed[1]))
+        if not found:
+            return None
+        _, path, size, crc = max(found)
+        return _Entry(path, size, crc)
+
+    def _retire(self, entry: _Entry):
+        """Под self._lock: файл удаляется сразу, mmap закрывается после последнего читателя."""
+        entry.evicted = True
+        entry.path.unlink(missing_ok=True)
+        self._close_unused(entry)
+
+    @staticmethod
+    def _close_unused(entry: _Entry):
+        if entry.evicted and entry.readers == 0 and entry.mmap is not None:
+            entry.mmap.close()
+            entry.mmap = None
+
+    def _evict(self) -> list[tuple[float, Path, int]]:
+        """
+        Общий бюджет max_bytes на каталог: под flock (один вытесняющий на все воркеры) сканируем
+        каталог и удаляем самые давно читанные файлы. Воркеры, у которых файл открыт через mmap,
+        заметят удаление при следующем чтении (os.utime) и закроют mmap сами.
+        :return: оставшиеся файлы
+        """
+        with open(self.directory / LOCK_NAME, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            files = sorted(self._scan())
+            total = sum(size for _, _, size in files)
+            while total > self.max_bytes and files:
+                _, path, size = files.pop(0)
+                path.unlink(missing_ok=True)
+                total -= size
+                uuid = _parse_name(path.name)[0]
+                with self._lock:
+                    entry = self._entries.get(uuid)
+                    if entry is not None and entry.path == path:
+                        del self._entries[uuid]
+                        self._retire(entry)
+            return files
+
+    def _drop(self, uuid: str, entry: _Entry | None = None):
+        """entry - удалять, только если под uuid всё ещё эта запись (не перезаписана)."""
+        with self._lock:
+            current = self._entries.get(uuid)
+            if current is None or (entry is not None and current is not entry):
+                return
+            del self._entries[uuid]
+            self._retire(current)
+
+    def _acquire(self, uuid: str):
+        """(entry, mmap) с учтённым читателем - вернуть через _release; None - нет в кэше или битый."""
+        with self._lock:
+            entry = self._entries.get(uuid)
+            if entry is None:
+                entry = self._find(uuid)
+                if entry is None:
+                    return None
+                self._entries[uuid] = entry
+            try:
+                if entry.mmap is None:
+                    with open(entry.path, 'rb') as file:
+                        entry.mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            except OSError as e:
+                api_logger.warning("Disk cache entry dropped", extra={"file_uuid": uuid, "error": str(e)})
+                del self._entries[uuid]
+                self._retire(entry)
+                return None
+            entry.readers += 1
+        buffer = entry.mmap
+        try:
+            if not entry.checked:
+                # Только заголовок и размер - страницы данных не трогаем; crc32 считает _verify в фоне
+                dtype, shape, _, layout = read_header_layout(buffer)
+                expected = HEADER_SIZE + int(np.prod(shape)) * dtype.itemsize
+                if layout != LAYOUT_SLICES or len(buffer) != expected:
+                    raise ValueError("Corrupted volume in disk cache")
+                entry.checked = True
+            os.utime(entry.path)
+            return entry, buffer
+        except (OSError, ValueError) as e:
+            api_logger.warning("Disk cache entry dropped", extra={"file_uuid": uuid, "error": str(e)})
+            self._release(entry)
+            self._drop(uuid, entry)
+            return None
+
+    def _release(self, entry: _Entry):
+        with self._lock:
+            entry.readers -= 1
+            self._close_unused(entry)
+
+    def _verify(self, uuid: str):
+        acquired = self._acquire(uuid)
+        if acquired is None:
+            return
+        entry, buffer = acquired
+        try:
+            ok = zlib.crc32(buffer) == entry.crc
+        finally:
+            entry.verifying = False
+            self._release(entry)
+        if ok:
+            entry.verified = True
+        else:
+            api_logger.warning("Disk cache entry dropped", extra={"file_uuid": uuid, "error": "crc32 mismatch"})
+            self._drop(uuid, entry)
+
+    def _schedule_verify(self, uuid: str):
+        with self._lock:
+            entry = self._entries.get(uuid)
+            if entry is None or entry.verified or entry.verifying:
+                return
+            entry.verifying = True
+        asyncio.get_running_loop().run_in_executor(None, self._verify, uuid)
+
+    def _put(self, uuid: str, data: bytes):
+        if not is_volume(data) or read_header_layout(data)[3] != LAYOUT_SLICES:
+            # Старые объекты из S3 (pickle, v1) переводим в срезовый формат
+            volume = load_volume_any(data)
+            spacing = read_header_layout(data)[2] if is_volume(data) else (1.0, 1.0, 1.0)
+            data = dump_volume(volume, spacing, layout=LAYOUT_SLICES)
+        if len(data) > self.max_bytes:
+            return
+        self._write(uuid, [data])
+
+    def _put_file(self, uuid: str, src_path: str):
+        """Копия готового LVOL-файла частями по COPY_CHUNK, без чтения в память целиком."""
+        with open(src_path, 'rb') as src:
+            header = src.read(HEADER_SIZE)
+            if not is_volume(header) or read_header_layout(header)[3] != LAYOUT_SLICES:
+                src.seek(0)
+                return self._put(uuid, src.read())
+            if os.fstat(src.fileno()).st_size > self.max_bytes:
+                return
+            src.seek(0)
+            self._write(uuid, iter(lambda: src.read(COPY_CHUNK), b''))
+
+    def _write(self, uuid: str, parts):
+        """Атомарная запись файла кэша из частей (crc32 считается по ходу) и учёт в LRU."""
+        crc, size = 0, 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                for part in parts:
+                    crc = zlib.crc32(part, crc)
+                    size += len(part)
+                    file.write(part)
+                file.flush()
+                os.fsync(file.fileno())
+            path = self.directory / f"{uuid}.{crc:08x}{SUFFIX}"
+            os.replace(tmp_path, path)
+        except BaseException:
+            Path(tmp_path).unlink(missing_ok=True)
+            raise
+
+        with self._lock:
+            old = self._entries.pop(uuid, None)
+            # Только что записан и посчитан crc - проверять не нужно
+            self._entries[uuid] = _Entry(path, size, crc, verified=True)
+            if old is not None:
+                # Тот же crc - тот же путь, уже заменён os.replace; старый mmap всё равно закрываем
+                old.evicted = True
+                if old.path != path:
+                    old.path.unlink(missing_ok=True)
+                self._close_unused(old)
+        self._evict()
+
+    def _volume(self, uuid: str):
+        acquired = self._acquire(uuid)
+        if acquired is None:
+            return None
+        entry, buffer = acquired
+        try:
+            volume = load_volume(buffer)
+            spacing = read_header_layout(buffer)[2]
+        except BaseException:
+            self._release(entry)
+            raise
+        # Читатель отпускается, когда умирает корневой массив поверх mmap (все view держат его через .base)
+        root = volume
+        while isinstance(root.base, np.ndarray):
+            root = root.base
+        weakref.finalize(root, self._release, entry)
+        return volume, spacing
+
+    def _slice(self, uuid: str, num_slice: int):
+        acquired = self._acquire(uuid)
+        if acquired is None:
+            return None
+        entry, buffer = acquired
+        try:
+            dtype, shape, _, _ = read_header_layout(buffer)
+            start, end = slice_range(num_slice, dtype, shape)
+            # Срез mmap - копия байт, так что массив не держит mmap открытым
+            return load_slice(buffer[start:end], dtype, shape)
+        finally:
+            self._release(entry)
+
+    async def get_volume(self, uuid):
+        """(том H x W x depth поверх mmap, spacing), None - нет в кэше."""
+        if not self.enabled:
+            return None
+        result = await asyncio.to_thread(self._volume, str(uuid))
+        if result is not None:
+            self._schedule_verify(str(uuid))
+        return result
+
+    async def get_slice(self, uuid, num_slice: int):
+        if not self.enabled:
+            return None
+        result = await asyncio.to_thread(self._slice, str(uuid), num_slice)
+        if result is not None:
+            self._schedule_verify(str(uuid))
+        return result
+
+    async def put(self, uuid, data: bytes):
+        """data - обработанный том как в S3 (LVOL любой версии или старый pickle)."""
+        if not self.enabled:
+            return
+        try:
+            await asyncio.to_thread(self._put, str(uuid), data)
+        except Exception as e:
+            api_logger.warning("Failed to write disk cache", extra={"file_uuid": str(uuid), "error": str(e)})
+
+    async def put_file(self, uuid, path: str):
+        """path - обработанный том в файле (временный LVOL загрузки); файл не удаляется."""
+        if not self.enabled:
+            return
+        try:
+            await asyncio.to_thread(self._put_file, str(uuid), path)
+        except Exception as e:
+            api_logger.warning("Failed to write disk cache", extra={"file_uuid": str(uuid), "error": str(e)})
+
+    async def delete(self, uuid):
+        if self.enabled:
+            await asyncio.to_thread(self._drop, str(uuid))
+
+
+disk_cache = DiskCache()
@@ -0,0 +1,126 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from fastapi import HTTPException, status
+
+from src.config import settings
+from src.logger import api_logger
+from src.service.model import modelManager
+from src.service.replicas import replica_pool
+
+
+def server_busy(request_id=None) -> HTTPException:
+    """Один и тот же 503 с Retry-After для всех очередей модели (пул, батчер)."""
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail={"msg": "Server is busy, try again later", "request_id": request_id},
+        headers={"Retry-After": "1"},
+    )
+
+
+class InferenceExecutor:
+    """
+    Пул потоков для синхронной работы модели (torch, OpenCV, skimage),
+    чтобы event loop занимался только I/O.
+    Очередь ограничена: при переполнении сразу отдаём 503.
+    Если запущены реплики (INFERENCE_REPLICAS > 0), методы modelManager
+    выполняются в процессах replica_pool, остальное - в потоках.
+    Фоновая работа (prefetch, производные) идёт через run_low: свои потоки (при репликах - своя
+    реплика) и свой лимит, слоты и очередь интерактивных запросов она не занимает и 503 им не вызывает.
+    """
+
+    def __init__(self):
+        self._pool = None
+        self._low_pool = None
+        self._low_slots: asyncio.Semaphore | None = None
+        self._max_pending = 0
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def start(self, workers: int = settings.INFERENCE_WORKERS,
+              queue_size: int = settings.INFERENCE_QUEUE_SIZE,
+              replicas: int = settings.INFERENCE_REPLICAS,
+              low_workers: int = settings.INFERENCE_LOW_PRIORITY_WORKERS):
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='inference')
+            self._low_pool = ThreadPoolExecutor(max_workers=max(1, low_workers), thread_name_prefix='inference-low')
+            self._low_slots = asyncio.Semaphore(max(1, low_workers))
+            self._max_pending = max(workers, replicas) + queue_size
+            if replicas:
+                replica_pool.start(
+                    replicas,
+                    backend=settings.MODEL_BACKEND,
+                    num_threads=settings.REPLICA_THREADS,
+                    interop_threads=settings.REPLICA_INTEROP_THREADS,
+                    pin_cores=settings.REPLICA_PIN_CORES,
+                    png_compression=settings.RENDER_PNG_COMPRESSION,
+                )
+            print(f'✅ Inference executor started ({workers} workers, {replicas} replicas, queue {queue_size})')
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._low_pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+            self._low_pool = None
+        replica_pool.shutdown()
+
+    def _submit(self, func, *args, low=False, **kwargs):
+        if replica_pool.started and getattr(func, '__self__', None) is modelManager:
+            submit = replica_pool.submit_low if low else replica_pool.submit
+            return submit(func.__name__, *args, **kwargs)
+        return (self._low_pool if low else self._pool).submit(partial(func, *args, **kwargs))
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def _acquire(self) -> bool:
+        with self._lock:
+            if self._pending >= self._max_pending:
+                return False
+            self._pending += 1
+            return True
+
+    def _release(self, _future=None):
+        with self._lock:
+            self._pending -= 1
+
+    async def run(self, func, *args, request_id=None, **kwargs):
+        if self._pool is None:
+            self.start()
+
+        if not self._acquire():
+            api_logger.warning(
+                "Inference queue is full",
+                extra={"pending": self._pending, "request_id": request_id}
+            )
+            raise server_busy(request_id)
+
+        try:
+            future = self._submit(func, *args, **kwargs)
+        except Exception:
+            self._release()
+            raise
+        # Слот освобождается только когда поток реально закончил работу,
+        # даже если клиент уже отключился и корутину отменили
+        future.add_done_callback(self._release)
+        return await asyncio.wrap_future(future)
+
+    async def run_low(self, func, *args, request_id=None, **kwargs):
+        """Низкий приоритет: ждёт свой слот (не больше low_workers задач сразу), без 503."""
+        if self._pool is None:
+            self.start()
+        async with self._low_slots:
+            future = self._submit(func, *args, low=True, **kwargs)
+            try:
+                return await asyncio.shield(asyncio.wrap_future(future))
+            except asyncio.CancelledError:
+                # Слот держим, пока поток не закончит, иначе полоса переполнится отменёнными задачами
+                await asyncio.wait([asyncio.wrap_future(future)])
+                raise
+
+
+inference_executor = InferenceExecutor()
@@ -0,0 +1,80 @@
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from src.config import settings
+
+
+def sizeof(value) -> int:
+    """Оценка занимаемой памяти: bytes, ndarray, dict/JSON-подобные списки (контуры)."""
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return len(value)
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (list, tuple)):
+        return 56 + sum(sizeof(item) for item in value)
+    if isinstance(value, dict):
+        return 232 + sum(sizeof(item) for item in value.values())
+    return 32
+
+
+class LocalCache:
+    """
+    L1-кэш в памяти процесса перед Redis: LRU с учётом байт и TTL.
+    Ключ - (вид, uuid, ...), так что всё по файлу сбрасывается invalidate(uuid).
+    Значения не копируются - массивы только для чтения, списки контуров не менять.
+    """
+
+    def __init__(self, max_bytes: int = settings.LOCAL_CACHE_MAX_BYTES, ttl: float = settings.LOCAL_CACHE_TTL):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._items: OrderedDict[tuple, tuple] = OrderedDict()  # key -> (value, nbytes, expires_at)
+        self._by_uuid: dict[str, set] = {}
+        self._bytes = 0
+
+    def get(self, key: tuple):
+        item = self._items.get(key)
+        if item is None:
+            return None
+        value, _, expires_at = item
+        if expires_at < time.monotonic():
+            self._pop(key)
+            return None
+        self._items.move_to_end(key)
+        return value
+
+    def set(self, key: tuple, value, nbytes: int | None = None):
+        if self.max_bytes <= 0 or value is None:
+            return
+        nbytes = sizeof(value) if nbytes is None else nbytes
+        # Один объект не должен вытеснять весь кэш (например, целый том)
+        if nbytes > self.max_bytes // 4:
+            self._pop(key)
+            return
+        self._pop(key)
+        self._items[key] = (value, nbytes, time.monotonic() + self.ttl)
+        self._by_uuid.setdefault(str(key[1]), set()).add(key)
+        self._bytes += nbytes
+        while self._bytes > self.max_bytes:
+            self._pop(next(iter(self._items)))
+
+    def invalidate(self, uuid):
+        for key in self._by_uuid.pop(str(uuid), ()):
+            item = self._items.pop(key, None)
+            if item is not None:
+                self._bytes -= item[1]
+
+    def _pop(self, key: tuple):
+        item = self._items.pop(key, None)
+        if item is None:
+            return
+        self._bytes -= item[1]
+        keys = self._by_uuid.get(str(key[1]))
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_uuid[str(key[1])]
+
+
+local_cache = LocalCache()
@@ -0,0 +1,74 @@
+import struct
+
+import numpy as np
+
+# Бинарный формат тома масок:
+#   заголовок <magic, version, depth, height, width>
+#   + depth срезов, каждый упакован np.packbits в (height * width + 7) // 8 байт.
+# Все срезы одной длины, поэтому смещение среза n считается из заголовка (slice_range).
+MAGIC = b'LMSK'
+VERSION = 1
+HEADER = struct.Struct('<4sB3xIII')
+
+
+def slice_nbytes(height: int, width: int) -> int:
+    return (height * width + 7) // 8
+
+
+def pack_masks(masks: np.ndarray) -> bytes:
+    """Бинарные маски (depth x H x W) -> bytes."""
+    masks = np.asarray(masks, dtype=bool)
+    depth, height, width = masks.shape
+    packed = np.packbits(masks.reshape(depth, height * width), axis=1)
+    return HEADER.pack(MAGIC, VERSION, depth, height, width) + packed.tobytes()
+
+
+def read_header(data) -> tuple[int, int, int]:
+    magic, version, depth, height, width = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"Unknown mask volume format {magic!r} v{version}")
+    return depth, height, width
+
+
+def slice_range(num_slice: int, height: int, width: int) -> tuple[int, int]:
+    """Байтовый диапазон [start, end) среза num_slice внутри упакованного тома."""
+    nbytes = slice_nbytes(height, width)
+    start = HEADER.size + num_slice * nbytes
+    return start, start + nbytes
+
+
+def check_slice(num_slice: int, depth: int):
+    if not 0 <= num_slice < depth:
+        raise IndexError(f"Slice {num_slice} out of range 0..{depth - 1}")
+
+
+def unpack_slice_bytes(data, height: int, width: int, offset: int = 0) -> np.ndarray:
+    """Байты одного упакованного среза -> маска H x W."""
+    bits = np.unpackbits(np.frombuffer(data, dtype=np.uint8, count=slice_nbytes(height, width), offset=offset),
+                         count=height * width)
+    return bits.reshape(height, width).astype(bool)
+
+
+def unpack_slice(data, num_slice: int) -> np.ndarray:
+    depth, height, width = read_header(data)
+    check_slice(num_slice, depth)
+    return unpack_slice_bytes(data, height, width, offset=slice_range(num_slice, height, width)[0])
+
+
+def unpack_masks(data) -> np.ndarray:
+    depth, height, width = read_header(data)
+    packed = np.frombuffer(data, dtype=np.uint8, offset=HEADER.size).reshape(depth, slice_nbytes(height, width))
+    return np.unpackbits(packed, axis=1, count=height * width).reshape(depth, height, width).astype(bool)
+
+
+def mask_statistics(masks: np.ndarray) -> dict:
+    """Площадь маски по срезам (в пикселях входа модели) и диапазон срезов с печенью."""
+    areas = np.asarray(masks, dtype=bool).reshape(len(masks), -1).sum(axis=1)
+    liver = np.flatnonzero(areas)
+    return {
+        'num_slices': len(areas),
+        'areas': areas.tolist(),
+        'total_area': int(areas.sum()),
+        'first_slice': int(liver[0]) if len(liver) else None,
+        'last_slice': int(liver[-1]) if len(liver) else None,
+    }
@@ -0,0 +1,139 @@
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Границы корзин гистограмм, миллисекунды
+LATENCY_BUCKETS_MS = (0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS_MS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, ms: float):
+        self.counts[bisect_left(self.buckets, ms)] += 1
+        self.count += 1
+        self.sum += ms
+
+    def cumulative(self) -> list[tuple[str, int]]:
+        """[(le, число наблюдений <= le), ...] как у Prometheus, последняя корзина '+Inf'."""
+        result, total = [], 0
+        for bound, count in zip([*map(str, self.buckets), '+Inf'], self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+    def snapshot(self) -> dict:
+        return {'count': self.count, 'sum_ms': round(self.sum, 3), 'buckets': dict(self.cumulative())}
+
+
+class KeyspaceMetrics:
+    __slots__ = ('local_hits', 'hits', 'misses', 'bytes_read', 'bytes_written', 'latency', 'serialization')
+
+    def __init__(self):
+        self.local_hits = 0
+        self.hits = 0
+        self.misses = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.latency = Histogram()
+        self.serialization = Histogram()
+
+    def snapshot(self) -> dict:
+        lookups = self.local_hits + self.hits + self.misses
+        return {
+            'local_hits': self.local_hits,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round((self.local_hits + self.hits) / lookups, 4) if lookups else None,
+            'bytes_read': self.bytes_read,
+            'bytes_written': self.bytes_written,
+            'latency_ms': self.latency.snapshot(),
+            'serialization_ms': self.serialization.snapshot(),
+        }
+
+
+class CacheMetrics:
+    """
+    Счётчики кэша по семействам ключей (file, file_metadata, img, contours, result, ...) в памяти процесса:
+    попадания в L1 и Redis, промахи, байты чтения/записи, гистограммы задержки Redis и (де)сериализации.
+    У каждого воркера свои значения - сборщик метрик опрашивает их по отдельности.
+    """
+
+    def __init__(self):
+        self._keyspaces: dict[str, KeyspaceMetrics] = {}
+
+    def keyspace(self, name: str) -> KeyspaceMetrics:
+        metrics = self._keyspaces.get(name)
+        if metrics is None:
+            metrics = self._keyspaces[name] = KeyspaceMetrics()
+        return metrics
+
+    def local_hit(self, name: str, count: int = 1):
+        self.keyspace(name).local_hits += count
+
+    def hit(self, name: str, nbytes: int = 0):
+        metrics = self.keyspace(name)
+        metrics.hits += 1
+        metrics.bytes_read += nbytes
+
+    def miss(self, name: str):
+        self.keyspace(name).misses += 1
+
+    def written(self, name: str, nbytes: int):
+        self.keyspace(name).bytes_written += nbytes
+
+    @contextmanager
+    def timed(self, name: str):
+        """Задержка обращения к Redis."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.keyspace(name).latency.observe((time.perf_counter() - start) * 1000)
+
+    @contextmanager
+    def serializing(self, name: str):
+        """Время кодирования / декодирования значения."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.keyspace(name).serialization.observe((time.perf_counter() - start) * 1000)
+
+    def snapshot(self) -> dict:
+        return {name: metrics.snapshot() for name, metrics in sorted(self._keyspaces.items())}
+
+    def prometheus(self) -> str:
+        """Текстовый формат экспозиции Prometheus."""
+        lines = []
+        counters = (
+            ('cache_local_hits_total', 'local_hits', 'Lookups served from the in-process cache'),
+            ('cache_hits_total', 'hits', 'Lookups served from Redis'),
+            ('cache_misses_total', 'misses', 'Lookups missed in every cache tier'),
+            ('cache_read_bytes_total', 'bytes_read', 'Bytes read from Redis'),
+            ('cache_written_bytes_total', 'bytes_written', 'Bytes written to Redis'),
+        )
+        items = sorted(self._keyspaces.items())
+        for metric, attr, help_text in counters:
+            lines += [f'# HELP {metric} {help_text}', f'# TYPE {metric} counter']
+            lines += [f'{metric}{{keyspace="{name}"}} {getattr(metrics, attr)}' for name, metrics in items]
+        histograms = (
+            ('cache_redis_latency_ms', 'latency', 'Redis round trip latency'),
+            ('cache_serialization_ms', 'serialization', 'Time spent encoding and decoding cached values'),
+        )
+        for metric, attr, help_text in histograms:
+            lines += [f'# HELP {metric} {help_text}', f'# TYPE {metric} histogram']
+            for name, metrics in items:
+                histogram = getattr(metrics, attr)
+                lines += [f'{metric}_bucket{{keyspace="{name}",le="{bound}"}} {count}'
+                          for bound, count in histogram.cumulative()]
+                lines.append(f'{metric}_sum{{keyspace="{name}"}} {histogram.sum:.3f}')
+                lines.append(f'{metric}_count{{keyspace="{name}"}} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+
+cache_metrics = CacheMetrics()
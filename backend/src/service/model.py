@@ -1,54 +1,38 @@
 import io
-import time
 
-import cv2
 import torch
 import numpy as np
 import nibabel as nib
-import segmentation_models_pytorch as smp
 import albumentations as A
 from albumentations.pytorch import ToTensorV2
-import matplotlib.pyplot as plt
-from skimage import measure
+
+from src.config import settings
+from src.service.backends import load_backend
+from src.service.contours import mask_to_polygons
+from src.service.render import render_gray, render_overlay
+from src.service.volume_format import dequantize
 
 
 class ModelSegmentationManager:
 
-    def __init__(self):
+    def __init__(self, png_compression: int = settings.RENDER_PNG_COMPRESSION):
         self.n_cls = 1
+        self.png_compression = png_compression
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
         # Преобразования для входного изображения
         self.trans = A.Compose([A.Resize(256, 256), ToTensorV2()])
         self.model = None
+        self.backend = None
 
-    def upload_model(self):
-        self.model = self.__load_model()
-        print('✅ Successfully upload model')
-
-    def __load_model(self):
-        model = smp.DeepLabV3Plus(classes=self.n_cls, in_channels=1)
-        try:
-            model.load_state_dict(torch.load('model.pth', map_location=self.device))
-        except FileNotFoundError:
-            raise RuntimeError("Model file not found")
-        model.to(self.device)
-        model.eval()
-        return model
-
-    @staticmethod
-    def __postprocess_mask(mask: torch.Tensor) -> torch.Tensor:
-        """Удаляет шумы из бинарной маски с помощью морфологических операций."""
-        mask_np = mask.squeeze(0).cpu().numpy().astype(np.uint8) * 255
-
-        # Удаляем мелкие шумы (открытие)
-        kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
-        mask_np = cv2.morphologyEx(mask_np, cv2.MORPH_OPEN, kernel)
-
-        # Заполняем мелкие дыры (закрытие)
-        mask_np = cv2.morphologyEx(mask_np, cv2.MORPH_CLOSE, kernel)
+    def upload_model(self, backend: str = 'eager', num_threads: int = 0, interop_threads: int = 0):
+        self.model = self.__load_model(backend, num_threads, interop_threads)
+        self.backend = backend
+        print(f'✅ Successfully upload model ({backend})')
 
-        return torch.from_numpy(mask_np / 255).unsqueeze(0).to(mask.device)
+    def __load_model(self, backend, num_threads, interop_threads):
+        # eager / torchscript / onnx - см. src/service/backends.py
+        return load_backend(backend, self.n_cls, self.device, num_threads, interop_threads)
 
     @staticmethod
     def preprocess_im(im):
@@ -60,44 +44,19 @@ class ModelSegmentationManager:
 
     @staticmethod
     def read_nii(file_bytes):
-
+        """:return: (том float32, размер вокселя по осям)"""
         file_stream = io.BytesIO(file_bytes)
         file_holder = nib.FileHolder(fileobj=file_stream)
         nii_image = nib.Nifti1Image.from_file_map({'header': file_holder, 'image': file_holder})
 
-        return nii_image.get_fdata().astype('float32')
+        spacing = tuple(float(z) for z in nii_image.header.get_zooms()[:3])
+        return nii_image.get_fdata().astype('float32'), spacing
 
     def apply_transformations(self, im):
-        transformed = self.trans(image=im)
+        # Срез мог храниться в uint16 / float16
+        transformed = self.trans(image=dequantize(im))
         return transformed["image"].unsqueeze(0).to(self.device, dtype=torch.float32)  # Сразу отправляем на GPU
 
-    @staticmethod
-    def __find_contours(mask):
-        mask = mask.squeeze(0).cpu().numpy().astype(np.uint8) * 255  # CPU + бинаризация
-        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-
-        contour_mask = np.zeros_like(mask)
-        if contours:
-            cv2.drawContours(contour_mask, contours, -1, 255, thickness=1)
-
-        return contour_mask
-
-    @staticmethod
-    def __display_results(image, liver_contour):
-        image_np = image.squeeze(0).cpu().numpy()  # Переводим в numpy заранее
-        fig, ax = plt.subplots(figsize=(image_np.shape[1] / 100, image_np.shape[0] / 100), dpi=100)
-
-        ax.axis("off")
-        ax.imshow(image_np, cmap="gray")
-        ax.contour(liver_contour, colors="r", linewidths=0.8)
-
-        buf = io.BytesIO()
-        plt.savefig(buf, format="png", bbox_inches="tight", pad_inches=0, transparent=True)
-        plt.close(fig)
-        buf.seek(0)
-
-        return buf.getvalue()
-
     def __draw_with_user_contours(self, image_slice, user_contours):
         """
         Рисует изображение с множеством пользовательских контуров.
@@ -116,96 +75,78 @@ class ModelSegmentationManager:
         image_norm = self.preprocess_im(image_slice)
         image_np = (image_norm * 255).astype(np.uint8)
 
-        mask_shape = image_np.shape
-        contour_mask = np.zeros((mask_shape[0], mask_shape[1], 3), dtype=np.uint8)
-
-        for contour in user_contours:
-            if len(contour) < 2:
-                continue
-            points = np.array(contour, dtype=np.int32).reshape((-1, 1, 2))
-            cv2.polylines(contour_mask, [points], isClosed=True, color=(255, 0, 0), thickness=1)
-
-        image_color = cv2.cvtColor(image_np, cv2.COLOR_GRAY2BGR)
-        combined = cv2.addWeighted(image_color, 1.0, contour_mask, 1.0, 0)
-
-        fig, ax = plt.subplots(figsize=(combined.shape[1] / 100, combined.shape[0] / 100), dpi=100)
-        ax.axis("off")
-        ax.imshow(combined)
-
-        buf = io.BytesIO()
-        plt.savefig(buf, format="png", bbox_inches="tight", pad_inches=0, transparent=True)
-        plt.close(fig)
-        buf.seek(0)
-
-        return buf.getvalue()
+        return render_overlay(image_np, user_contours, self.png_compression)
 
     def pred_image(self, image_volume, num_images):
         image = image_volume[:, :, num_images]
         image = self.apply_transformations(image)
         return image
 
-    def get_result_contours(self, image):
-        with torch.no_grad():
-            y_pred = torch.sigmoid(self.model(image)) > 0.7
-        contour = self.__find_contours(y_pred[0])
-        contours = measure.find_contours(contour, level=0.7)
-        mass_check = set()
-        contours_list = []
-        for contour in contours:
-            new_counter = []
-            for point in contour:
-                tupl = (round(point[1], 1), round(point[0], 1))
-                if tupl not in mass_check:
-                    mass_check.add(tupl)
-                    new_counter.append(list(tupl))
-            contours_list.append(new_counter)
-
-        # contours_list = [[[int(point[1]), int(point[0])] for point in contour] for contour in contours]
-        return contours_list
+    def pred_slice(self, image_slice):
+        return self.apply_transformations(image_slice)
 
-    def create_photo_with_contours(self, image, contours_list):
-        result_img = self.__draw_with_user_contours(image[0], contours_list)
-        return result_img
-
-    def get_result(self, image_volume, num_images):
-        time_start1 = time.time()
-        image = image_volume[:, :, num_images]
-        image = self.apply_transformations(image)
+    def pred_volume(self, image_volume, start, stop):
+        """Собирает срезы [start, stop) тома в один батч (N x 1 x H x W)."""
+        images = [self.apply_transformations(image_volume[:, :, num]) for num in range(start, stop)]
+        return torch.cat(images, dim=0)
 
+    def predict_masks(self, images):
         with torch.no_grad():
-            y_pred = torch.sigmoid(self.model(image)) > 0.7  # 0.5
-            # y_pred = self.__postprocess_mask(y_pred)  # Очищаем маску  # Прямо в одном вызове
-
-        contour = self.__find_contours(y_pred[0])
-        print(time.time() - time_start1)
+            return torch.sigmoid(self.model(images)) > 0.7
 
-        def mask_to_contour(mask: np.ndarray):
-            contours = measure.find_contours(mask, level=0.7)
-            # Переводим в формат [[x, y], [x, y], ...]
-            contours_list = [[[int(point[1]), int(point[0])] for point in contour] for contour in contours]
-            return contours_list
+    def get_result_contours(self, image):
+        y_pred = self.predict_masks(image)
+        return self.mask_to_contours(y_pred[0])
 
-        new_contour = mask_to_contour(contour)
-        time_start = time.time()
-        result_img = self.__display_results(image[0], contour)
-        result_img = self.__draw_with_user_contours(image[0], new_contour)
-        print(time.time() - time_start)
+    def get_result_contours_batch(self, images):
+        y_pred = self.predict_masks(images)
+        return [self.mask_to_contours(mask) for mask in y_pred]
 
-        return result_img, new_contour
+    def predict_volume_masks(self, image_volume, batch_size):
+        """
+        Прогоняет все срезы тома через модель мини-батчами.
+        :return: bool-массив масок (depth x H x W) в разрешении модели
+        """
+        depth = image_volume.shape[2]
+        masks = []
+        for start in range(0, depth, batch_size):
+            images = self.pred_volume(image_volume, start, min(start + batch_size, depth))
+            masks.append(self.predict_masks(images).squeeze(1).cpu().numpy())
+        return np.concatenate(masks)
+
+    def segment_volume(self, image_volume, batch_size):
+        """
+        :return: (маски тома, список контуров), индекс в списке = номер среза
+        """
+        masks = self.predict_volume_masks(image_volume, batch_size)
+        return masks, [mask_to_polygons(mask) for mask in masks]
 
     @staticmethod
-    def get_photo(image):
+    def mask_to_contours(mask):
+        return mask_to_polygons(mask.squeeze(0).cpu().numpy())
+
+    def create_photo_with_contours(self, image, contours_list):
+        result_img = self.__draw_with_user_contours(image[0], contours_list)
+        return result_img
+
+    def get_result(self, image_volume, num_images):
+        image = self.pred_image(image_volume, num_images)
+        contours = self.get_result_contours(image)
+        return self.create_photo_with_contours(image, contours), contours
+
+    def get_photo(self, image):
         image_np = image[0].squeeze(0).cpu().numpy()
-        fig, ax = plt.subplots(figsize=(image_np.shape[1] / 100, image_np.shape[0] / 100), dpi=100)
+        return render_gray(image_np, self.png_compression)
 
-        ax.axis("off")
-        ax.imshow(image_np, cmap="gray")
+    def render_slice(self, image_slice, contours_list):
+        """Сырой срез -> (PNG с контурами, PNG без контуров) за один вызов воркера."""
+        image = self.pred_slice(image_slice)
+        return self.create_photo_with_contours(image, contours_list), self.get_photo(image)
 
-        buf = io.BytesIO()
-        plt.savefig(buf, format="png", bbox_inches="tight", pad_inches=0, transparent=True)
-        plt.close(fig)
-        buf.seek(0)
-        return buf.getvalue()
+    def get_photos(self, image_volume):
+        """PNG всех срезов тома (H x W x k), как get_photo для каждого."""
+        images = self.pred_volume(image_volume, 0, image_volume.shape[2])
+        return [self.get_photo(images[i:i + 1]) for i in range(len(images))]
 
 
 modelManager = ModelSegmentationManager()
@@ -0,0 +1,132 @@
+import asyncio
+from collections import OrderedDict
+
+from src.config import settings
+from src.logger import api_logger
+from src.service.batcher import segmentation_batcher
+from src.service.inference import inference_executor
+from src.service.model import modelManager
+from src.service.redis_conn import (
+    get_metadata, get_slice_redis,
+    get_contours_cached, load_contours_cached,
+    get_result_cached, load_result_cached,
+    get_clear_photo_cached, load_clear_photo,
+)
+
+KINDS = ('contours', 'result', 'img')
+
+
+class Prefetcher:
+    """
+    Фоновый предрасчёт соседних срезов N±1..N±depth после того, как отдали срез N.
+    Стартует, когда модель простаивает, а считает в отдельной низкоприоритетной полосе
+    inference_executor.run_low, так что слоты интерактивных запросов не занимает.
+    На каждый файл не больше budget предрасчитанных срезов (в рамках процесса).
+    """
+
+    def __init__(self, depth: int = settings.PREFETCH_DEPTH,
+                 budget: int = settings.PREFETCH_FILE_BUDGET,
+                 queue_size: int = settings.PREFETCH_QUEUE_SIZE):
+        self.depth = depth
+        self.budget = budget
+        self.queue_size = queue_size
+        self._queue: asyncio.Queue | None = None
+        self._worker: asyncio.Task | None = None
+        # file_uuid -> уже предрасчитанные срезы; старые файлы вытесняются
+        self._spent: OrderedDict[str, set] = OrderedDict()
+
+    def start(self):
+        if self._worker is None and self.depth > 0:
+            self._queue = asyncio.Queue(maxsize=self.queue_size)
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    def schedule(self, file_uuid, num_slice: int, kinds=KINDS):
+        if self._worker is None:
+            return
+        try:
+            self._queue.put_nowait((str(file_uuid), num_slice, kinds))
+        except asyncio.QueueFull:
+            pass
+
+    def _spent_for(self, file_uuid) -> set:
+        spent = self._spent.setdefault(file_uuid, set())
+        self._spent.move_to_end(file_uuid)
+        while len(self._spent) > 1024:
+            self._spent.popitem(last=False)
+        return spent
+
+    @staticmethod
+    async def _wait_idle():
+        while inference_executor.pending or not segmentation_batcher.idle:
+            await asyncio.sleep(0.05)
+
+    async def _run(self):
+        while True:
+            file_uuid, num_slice, kinds = await self._queue.get()
+            try:
+                await self._prefetch(file_uuid, num_slice, kinds)
+            except Exception as e:
+                api_logger.info(
+                    "Prefetch skipped",
+                    extra={"file_uuid": file_uuid, "num_slice": num_slice, "error": str(e)}
+                )
+
+    async def _prefetch(self, file_uuid, num_slice, kinds):
+        metadata = await get_metadata(file_uuid)
+        if metadata is None:
+            return
+        spent = self._spent_for(file_uuid)
+
+        neighbours = []
+        for step in range(1, self.depth + 1):
+            for num in (num_slice + step, num_slice - step):
+                if 0 <= num <= metadata['num_slices'] and num not in spent:
+                    neighbours.append(num)
+
+        for num in neighbours:
+            if len(spent) >= self.budget:
+                return
+            spent.add(num)
+            await self._wait_idle()
+            await self._fill(file_uuid, metadata, num, kinds)
+
+    @staticmethod
+    async def _fill(file_uuid, metadata, num, kinds):
+        image = None
+
+        async def load_image():
+            if image is not None:
+                return image
+            image_slice = await get_slice_redis(file_uuid, num, metadata)
+            if image_slice is None:
+                raise LookupError('volume evicted from Redis')
+            return await asyncio.to_thread(modelManager.pred_slice, image_slice)
+
+        if 'contours' in kinds or 'result' in kinds:
+            contours = await get_contours_cached(file_uuid, num)
+            if contours is None:
+                image = await load_image()
+                contours = await inference_executor.run_low(modelManager.get_result_contours, image)
+                await load_contours_cached(file_uuid, num, contours)
+
+            if 'result' in kinds and await get_result_cached(file_uuid, num) is None:
+                image = await load_image()
+                result_img = await inference_executor.run_low(modelManager.create_photo_with_contours, image,
+                                                              contours)
+                await load_result_cached(file_uuid, num, result_img)
+
+        if 'img' in kinds and await get_clear_photo_cached(file_uuid, num) is None:
+            image = await load_image()
+            await load_clear_photo(file_uuid, num, await inference_executor.run_low(modelManager.get_photo, image))
+
+
+prefetcher = Prefetcher()
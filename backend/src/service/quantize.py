@@ -0,0 +1,101 @@
+import nibabel as nib
+import numpy as np
+
+from src.service.backends import MODEL_PATHS
+from src.service.model import ModelSegmentationManager
+
+
+def load_volume(path):
+    """Читает .nii / .nii.gz с диска и нормализует так же, как при загрузке через API."""
+    volume = nib.load(path).get_fdata().astype('float32')
+    return ModelSegmentationManager.preprocess_im(volume)
+
+
+def synthetic_volume(depth=32, size=512, seed=0):
+    """Фантом: шум + эллипс «печени», который меняет размер от среза к срезу."""
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[:size, :size]
+    volume = rng.normal(0.2, 0.05, (size, size, depth)).astype('float32')
+    for num in range(depth):
+        scale = 0.5 + 0.5 * np.sin(np.pi * (num + 1) / (depth + 1))
+        a, b = size * 0.25 * scale, size * 0.18 * scale
+        ellipse = ((xx - size * 0.4) / a) ** 2 + ((yy - size * 0.45) / b) ** 2 <= 1
+        volume[:, :, num][ellipse] += 0.5
+    return ModelSegmentationManager.preprocess_im(volume)
+
+
+def iter_batches(manager, volume, batch_size):
+    depth = volume.shape[2]
+    for start in range(0, depth, batch_size):
+        yield manager.pred_volume(volume, start, min(start + batch_size, depth)).cpu()
+
+
+class SliceCalibrationReader:
+    """CalibrationDataReader для onnxruntime: отдаёт срезы тех же размеров и нормализации, что и в проде."""
+
+    def __init__(self, volumes, max_slices=64, input_name='image'):
+        manager = ModelSegmentationManager()
+        self.input_name = input_name
+        self._batches = []
+        for volume in volumes:
+            step = max(1, volume.shape[2] * len(volumes) // max_slices)
+            for num in range(0, volume.shape[2], step):
+                self._batches.append(manager.pred_image(volume, num).cpu().numpy())
+        self._iter = iter(self._batches)
+
+    def get_next(self):
+        batch = next(self._iter, None)
+        return None if batch is None else {self.input_name: batch}
+
+    def rewind(self):
+        self._iter = iter(self._batches)
+
+
+def quantize_onnx(volumes, fp32_path=MODEL_PATHS['onnx'], int8_path=MODEL_PATHS['onnx-int8'], max_slices=64):
+    """Статическая INT8-квантизация ONNX-модели с калибровкой по срезам volumes."""
+    try:
+        from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+    except ImportError:
+        raise RuntimeError("onnxruntime is not installed")
+
+    class Reader(SliceCalibrationReader, CalibrationDataReader):
+        pass
+
+    quantize_static(
+        fp32_path, int8_path,
+        Reader(volumes, max_slices=max_slices),
+        quant_format=QuantFormat.QDQ,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+        per_channel=True,
+    )
+    return int8_path
+
+
+def dice(a: np.ndarray, b: np.ndarray) -> float:
+    total = a.sum() + b.sum()
+    return 1.0 if total == 0 else 2.0 * np.logical_and(a, b).sum() / total
+
+
+def iou(a: np.ndarray, b: np.ndarray) -> float:
+    union = np.logical_or(a, b).sum()
+    return 1.0 if union == 0 else np.logical_and(a, b).sum() / union
+
+
+def compare_masks(reference: ModelSegmentationManager, candidate: ModelSegmentationManager,
+                  volume, batch_size=8):
+    """Dice / IoU масок candidate относительно reference по всему тому (и худший срез)."""
+    dices, ious = [], []
+    for images in iter_batches(reference, volume, batch_size):
+        expected = reference.predict_masks(images.to(reference.device)).cpu().numpy()
+        actual = candidate.predict_masks(images.to(candidate.device)).cpu().numpy()
+        for exp, act in zip(expected, actual):
+            dices.append(dice(exp, act))
+            ious.append(iou(exp, act))
+    return {
+        'slices': len(dices),
+        'dice_mean': float(np.mean(dices)),
+        'dice_min': float(np.min(dices)),
+        'iou_mean': float(np.mean(ious)),
+        'iou_min': float(np.min(ious)),
+    }
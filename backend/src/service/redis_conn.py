@@ -1,13 +1,55 @@
 import asyncio
-import io
 import json
-import pickle
+import math
+import random
+import time
 
+import numpy as np
 import redis.asyncio as redis
 from fastapi import HTTPException, status
 
 from src.config import settings
 from src.logger import database_logger
+from src.service.local_cache import local_cache
+from src.service.contour_codec import encode_contours, decode_contours, is_contours
+from src.service.metrics import cache_metrics
+from src.service.volume_format import load_volume_any, load_volume, dump_volume
+
+PNG_SIGNATURE = b'\x89PNG'
+
+# Семейство ключа - префикс до первого ':' -> базовый TTL, секунды
+KEYSPACE_TTL = {
+    'file': settings.REDIS_EXP,
+    'file_metadata': settings.REDIS_EXP,
+    'img': settings.REDIS_TTL_IMG,
+    'result': settings.REDIS_TTL_RESULT,
+    'contours': settings.REDIS_TTL_CONTOURS,
+    'mask': settings.REDIS_TTL_MASK,
+    'derivatives': settings.REDIS_TTL_DERIVATIVES,
+}
+DEFAULT_TTL = 60 * 30
+
+
+def keyspace(key) -> str:
+    if isinstance(key, bytes):
+        key = key.decode(errors='replace')
+    return key.split(':', 1)[0]
+
+
+def ttl_for(key) -> int:
+    """TTL для записи ключа: базовый TTL семейства с небольшим случайным разбросом."""
+    base = KEYSPACE_TTL.get(keyspace(key), DEFAULT_TTL)
+    return int(base * (1 + random.uniform(0, settings.REDIS_TTL_JITTER)))
+
+
+def should_refresh(ttl_ms: int, window_s: float = settings.REDIS_EARLY_REFRESH_S) -> bool:
+    """
+    Вероятностное раннее продление (XFetch): чем ближе истечение, тем вероятнее продлить.
+    Популярные ключи продлеваются заранее одним из читателей, а не истекают все разом.
+    """
+    if ttl_ms < 0:
+        return False
+    return ttl_ms / 1000 <= -window_s * math.log(1.0 - random.random())
 
 
 class RedisClient:
@@ -47,33 +89,112 @@ class RedisClient:
     async def load_files(self, name_obj, obj):
         try:
             r = await self.get_redis()
-            await r.setex(name_obj,
-                          60 * 30,
-                          obj
-                          )
+            with cache_metrics.timed(keyspace(name_obj)):
+                await r.setex(name_obj,
+                              ttl_for(name_obj),
+                              obj
+                              )
+            cache_metrics.written(keyspace(name_obj), len(obj))
         except Exception as e:
             database_logger.error(e)
             raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                                 detail={"msg": "Obj is not cached", })
 
+    async def load_files_many(self, objs: dict):
+        if not objs:
+            return
+        # Отдельный pipeline на семейство ключей - у каждого своя задержка в метриках
+        by_keyspace = {}
+        for name_obj, obj in objs.items():
+            by_keyspace.setdefault(keyspace(name_obj), {})[name_obj] = obj
+        try:
+            r = await self.get_redis()
+            for name, items in by_keyspace.items():
+                pipe = r.pipeline()
+                for name_obj, obj in items.items():
+                    pipe.setex(name_obj, ttl_for(name_obj), obj)
+                with cache_metrics.timed(name):
+                    await pipe.execute()
+                cache_metrics.written(name, sum(len(obj) for obj in items.values()))
+        except Exception as e:
+            database_logger.error(e)
+            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                                detail={"msg": "Obj is not cached", })
 
-async def load_files_redis(uuid, image_volume, num_slices, author_id, is_public):
+    async def get_refreshing(self, name_obj):
+        """GET с вероятностным ранним продлением TTL (производные детерминированы, пересчитывать незачем)."""
+        r = await self.get_redis()
+        pipe = r.pipeline()
+        pipe.get(name_obj)
+        pipe.pttl(name_obj)
+        with cache_metrics.timed(keyspace(name_obj)):
+            data, ttl_ms = await pipe.execute()
+        if data is not None and should_refresh(ttl_ms):
+            await r.expire(name_obj, ttl_for(name_obj))
+        return data
+
+
+def chunk_key(uuid, num_chunk):
+    return f'file:{uuid}:chunk:{num_chunk}'
+
+
+async def load_files_redis(uuid, image_volume, num_slices, author_id, is_public, spacing=(1.0, 1.0, 1.0)):
+    """
+    Том кладётся кусками по chunk_size срезов (file:{uuid}:chunk:{k}, формат volume_format),
+    чтобы запрос одного среза тянул из Redis только свой кусок.
+    """
+    chunk_size = settings.VOLUME_CHUNK_SLICES
+    # Один TTL на весь том; метаданные истекают чуть раньше кусков, чтобы не ссылаться на пропавшие куски
+    ttl = ttl_for('file')
+    local_cache.invalidate(uuid)
     try:
         redis = await redis_client.get_redis()
         pipe = redis.pipeline()
 
-        pipe.setex(f'file:{uuid}',
-                   redis_client.exp,
-                   pickle.dumps(image_volume)
-                   )
-
-        pipe.setex(f'file_metadata:{uuid}',
-                   redis_client.exp,
-                   json.dumps({'num_slices': num_slices,
+        # Отправляем пачками, чтобы не держать в памяти сериализованную копию всего тома;
+        # метаданные пишутся последними, так что недописанный том не виден читателям
+        pending = 0
+        for num_chunk, start in enumerate(range(0, image_volume.shape[2], chunk_size)):
+            with cache_metrics.serializing('file'):
+                chunk = dump_volume(image_volume[:, :, start:start + chunk_size], spacing,
+                                    settings.VOLUME_STORAGE_DTYPE)
+            pipe.setex(chunk_key(uuid, num_chunk), ttl, chunk)
+            cache_metrics.written('file', len(chunk))
+            pending += len(chunk)
+            if pending >= 32 * 1024 * 1024:
+                with cache_metrics.timed('file'):
+                    await pipe.execute()
+                pending = 0
+
+        metadata = json.dumps({'num_slices': num_slices,
                                "author_id": author_id,
-                               "is_public": is_public})
-                   )
-        await pipe.execute()
+                               "is_public": is_public,
+                               "chunk_size": chunk_size})
+        pipe.setex(f'file_metadata:{uuid}', ttl - 1, metadata)
+        cache_metrics.written('file_metadata', len(metadata))
+        with cache_metrics.timed('file'):
+            await pipe.execute()
+    except Exception as e:
+        database_logger.error(e)
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                            detail={"msg": "Obj is not cached", })
+
+
+async def load_alias_metadata(uuid, storage_uuid, num_slices, author_id, is_public):
+    """
+    Метаданные дубликата: свои author_id / is_public для проверки доступа,
+    данные (куски тома, контуры, PNG, маски) читаются по storage_uuid.
+    """
+    local_cache.invalidate(uuid)
+    try:
+        redis = await redis_client.get_redis()
+        await redis.setex(f'file_metadata:{uuid}',
+                          ttl_for('file_metadata'),
+                          json.dumps({'num_slices': num_slices,
+                                      "author_id": author_id,
+                                      "is_public": is_public,
+                                      "storage_uuid": str(storage_uuid)})
+                          )
     except Exception as e:
         database_logger.error(e)
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -81,21 +202,26 @@ async def load_files_redis(uuid, image_volume, num_slices, author_id, is_public)
 
 
 async def load_clear_photo(uuid, num_slices, img):
-    await redis_client.load_files(f'img:{uuid}:{num_slices}', pickle.dumps(img))
+    await redis_client.load_files(f'img:{uuid}:{num_slices}', img)
+    local_cache.set(('img', str(uuid), num_slices), img)
 
 
 async def get_clear_photo_cached(uuid, num_slices):
+    key = ('img', str(uuid), num_slices)
+    if (data := local_cache.get(key)) is not None:
+        cache_metrics.local_hit('img')
+        return data
     try:
-        redis = await redis_client.get_redis()
-        data = await redis.get(f'img:{uuid}:{num_slices}')
+        data = await redis_client.get_refreshing(f'img:{uuid}:{num_slices}')
 
-        if data is not None:
-            print('cache result')
-            buffer = io.BytesIO(data)
-            return pickle.load(buffer)
-        else:
-            print('miss result')
+        # Старые записи (pickle) считаем промахом
+        if data is not None and data.startswith(PNG_SIGNATURE):
+            cache_metrics.hit('img', len(data))
+            local_cache.set(key, data)
             return data
+        else:
+            cache_metrics.miss('img')
+            return None
 
     except Exception as e:
         database_logger.error(e)
@@ -103,16 +229,32 @@ async def get_clear_photo_cached(uuid, num_slices):
                             detail={"msg": "redis dead", })
 
 
+def _decode_contours(data):
+    # Записи до перехода на LCNT лежат в JSON
+    return decode_contours(data) if is_contours(data) else json.loads(data)
+
+
 async def load_contours_cached(uuid, num_slices, data):
-    await redis_client.load_files(f'contours:{uuid}:{num_slices}', json.dumps(data))
+    with cache_metrics.serializing('contours'):
+        encoded = encode_contours(data)
+    await redis_client.load_files(f'contours:{uuid}:{num_slices}', encoded)
+    local_cache.set(('contours', str(uuid), num_slices), data)
 
 
 async def get_contours_cached(uuid, num_slices):
+    key = ('contours', str(uuid), num_slices)
+    if (contours := local_cache.get(key)) is not None:
+        cache_metrics.local_hit('contours')
+        return contours
     try:
-        redis = await redis_client.get_redis()
-        data = await redis.get(f'contours:{uuid}:{num_slices}')
+        data = await redis_client.get_refreshing(f'contours:{uuid}:{num_slices}')
         if data:
-            return json.loads(data)
+            cache_metrics.hit('contours', len(data))
+            with cache_metrics.serializing('contours'):
+                contours = _decode_contours(data)
+            local_cache.set(key, contours)
+            return contours
+        cache_metrics.miss('contours')
         return None
     except Exception as e:
         database_logger.error(e)
@@ -120,22 +262,54 @@ async def get_contours_cached(uuid, num_slices):
                             detail={"msg": "Obj is not cached", })
 
 
+async def load_contours_volume_cached(uuid, contours_volume, start: int = 0):
+    """contours_volume[i] - контуры среза start + i."""
+    with cache_metrics.serializing('contours'):
+        encoded = {
+            f'contours:{uuid}:{num_slices}': encode_contours(data)
+            for num_slices, data in enumerate(contours_volume, start)
+        }
+    await redis_client.load_files_many(encoded)
+    for num_slices, data in enumerate(contours_volume, start):
+        local_cache.set(('contours', str(uuid), num_slices), data)
+
+
+async def load_derivatives_progress(uuid, state, done, total):
+    await redis_client.load_files(f'derivatives:{uuid}',
+                                  json.dumps({'status': state, 'done': done, 'total': total}))
+
+
+async def get_derivatives_progress(uuid):
+    try:
+        redis = await redis_client.get_redis()
+        data = await redis.get(f'derivatives:{uuid}')
+        return json.loads(data) if data else None
+    except Exception as e:
+        database_logger.error(e)
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                            detail={"msg": "redis dead", })
+
+
 async def load_result_cached(uuid, num_slices, data):
-    await redis_client.load_files(f'result:{uuid}:{num_slices}', pickle.dumps(data))
+    await redis_client.load_files(f'result:{uuid}:{num_slices}', data)
+    local_cache.set(('result', str(uuid), num_slices), data)
 
 
 async def get_result_cached(uuid, num_slices):
+    key = ('result', str(uuid), num_slices)
+    if (data := local_cache.get(key)) is not None:
+        cache_metrics.local_hit('result')
+        return data
     try:
-        redis = await redis_client.get_redis()
-        data = await redis.get(f'result:{uuid}:{num_slices}')
+        data = await redis_client.get_refreshing(f'result:{uuid}:{num_slices}')
 
-        if data is not None:
-            print('cache result')
-            buffer = io.BytesIO(data)
-            return pickle.load(buffer)
-        else:
-            print('miss result')
+        if data is not None and data.startswith(PNG_SIGNATURE):
+            cache_metrics.hit('result', len(data))
+            local_cache.set(key, data)
             return data
+        else:
+            cache_metrics.miss('result')
+            return None
 
     except Exception as e:
         database_logger.error(e)
@@ -143,32 +317,363 @@ async def get_result_cached(uuid, num_slices):
                             detail={"msg": "redis dead", })
 
 
+async def load_mask_cached(uuid, data):
+    await redis_client.load_files(f'mask:{uuid}', data)
+    local_cache.set(('mask', str(uuid)), data)
+
+
+async def get_mask_cached(uuid):
+    key = ('mask', str(uuid))
+    if (data := local_cache.get(key)) is not None:
+        cache_metrics.local_hit('mask')
+        return data
+    try:
+        data = await redis_client.get_refreshing(f'mask:{uuid}')
+        if data is None:
+            cache_metrics.miss('mask')
+            return None
+        cache_metrics.hit('mask', len(data))
+        local_cache.set(key, data)
+        return data
+    except Exception as e:
+        database_logger.error(e)
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                            detail={"msg": "redis dead", })
+
+
+async def get_mask_range_cached(uuid, start, end):
+    """
+    Байты [start, end) тома масок через GETRANGE, без чтения всего тома.
+    None - тома в Redis нет; b'' - запомненное отсутствие тома (или диапазон за его концом).
+    """
+    if (data := local_cache.get(('mask', str(uuid)))) is not None:
+        cache_metrics.local_hit('mask')
+        return bytes(data[start:end])
+    try:
+        r = await redis_client.get_redis()
+        pipe = r.pipeline()
+        pipe.exists(f'mask:{uuid}')
+        pipe.getrange(f'mask:{uuid}', start, end - 1)
+        with cache_metrics.timed('mask'):
+            exists, data = await pipe.execute()
+        if not exists:
+            cache_metrics.miss('mask')
+            return None
+        cache_metrics.hit('mask', len(data))
+        return data
+    except Exception as e:
+        database_logger.error(e)
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                            detail={"msg": "redis dead", })
+
+
 async def get_metadata(uuid):
+    key = ('metadata', str(uuid))
+    if (metadata := local_cache.get(key)) is not None:
+        cache_metrics.local_hit('file_metadata')
+        return metadata
     try:
         redis = await redis_client.get_redis()
-        metadata_file = await redis.get(f'file_metadata:{uuid}')
+        with cache_metrics.timed('file_metadata'):
+            metadata_file = await redis.get(f'file_metadata:{uuid}')
 
         if not metadata_file:
+            cache_metrics.miss('file_metadata')
             return None
-        return json.loads(metadata_file)
+        cache_metrics.hit('file_metadata', len(metadata_file))
+        with cache_metrics.serializing('file_metadata'):
+            metadata = json.loads(metadata_file)
+        local_cache.set(key, metadata)
+        return metadata
+    except Exception as e:
+        database_logger.error(e)
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                            detail={"msg": "redis dead", })
+
+
+async def is_file_cached(uuid):
+    """True, если том лежит в Redis (есть его метаданные), иначе None - как промах для single_flight."""
+    redis = await redis_client.get_redis()
+    return True if await redis.exists(f'file_metadata:{uuid}') else None
+
+
+async def drop_evicted_volume(uuid):
+    """
+    Кусок тома вытеснен (LRU), а метаданные ещё лежат: это промах, а не ошибка.
+    Метаданные удаляются, чтобы следующие запросы сразу шли на диск / в S3 и заново грели Redis.
+    """
+    cache_metrics.miss('file')
+    local_cache.invalidate(uuid)
+    try:
+        redis = await redis_client.get_redis()
+        await redis.delete(f'file_metadata:{uuid}')
+    except Exception as e:
+        database_logger.error(e)
+    return None
+
+
+async def get_files_redis(uuid, metadata=None):
+    """
+    Весь том: склеивает куски одним MGET. Записи без chunk_size - старый формат file:{uuid}.
+    None - тома (или какого-то его куска) в Redis уже нет.
+    """
+    key = ('volume', str(uuid))
+    if (volume := local_cache.get(key)) is not None:
+        cache_metrics.local_hit('file')
+        return volume
+    try:
+        redis = await redis_client.get_redis()
+        if metadata is None:
+            metadata = await get_metadata(uuid)
+
+        if metadata is None or 'chunk_size' not in metadata:
+            with cache_metrics.timed('file'):
+                file = await redis.get(f'file:{uuid}')
+            if file is None:
+                return await drop_evicted_volume(uuid)
+            cache_metrics.hit('file', len(file))
+            with cache_metrics.serializing('file'):
+                volume = load_volume_any(file)
+        else:
+            num_chunks = -(-(metadata['num_slices'] + 1) // metadata['chunk_size'])
+            with cache_metrics.timed('file'):
+                chunks = await redis.mget([chunk_key(uuid, k) for k in range(num_chunks)])
+            if any(chunk is None for chunk in chunks):
+                return await drop_evicted_volume(uuid)
+            cache_metrics.hit('file', sum(len(chunk) for chunk in chunks))
+            with cache_metrics.serializing('file'):
+                volume = np.concatenate([load_volume(chunk) for chunk in chunks], axis=2)
+        volume.flags.writeable = False
+        local_cache.set(key, volume)
+        return volume
     except Exception as e:
         database_logger.error(e)
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                             detail={"msg": "redis dead", })
 
 
-async def get_files_redis(uuid):
+async def get_slice_redis(uuid, num_slice, metadata=None):
+    """Один срез (H x W): из Redis читается только кусок, в котором он лежит. None - кусок вытеснен."""
     try:
         redis = await redis_client.get_redis()
-        file = await redis.get(f'file:{uuid}')
-        buffer = io.BytesIO(file)
-        if buffer is None:
-            print('miss file')
-        return pickle.load(buffer)
+        if metadata is None:
+            metadata = await get_metadata(uuid)
+
+        if metadata is None or 'chunk_size' not in metadata:
+            volume = await get_files_redis(uuid, metadata)
+            return None if volume is None else volume[:, :, num_slice]
+
+        chunk_size = metadata['chunk_size']
+        key = ('chunk', str(uuid), num_slice // chunk_size)
+        if (chunk := local_cache.get(key)) is None:
+            with cache_metrics.timed('file'):
+                data = await redis.get(chunk_key(uuid, num_slice // chunk_size))
+            if data is None:
+                return await drop_evicted_volume(uuid)
+            cache_metrics.hit('file', len(data))
+            # Соседние срезы того же куска дальше берутся из памяти процесса
+            with cache_metrics.serializing('file'):
+                chunk = load_volume(data)
+            local_cache.set(key, chunk)
+        else:
+            cache_metrics.local_hit('file')
+        return chunk[:, :, num_slice % chunk_size]
+    except HTTPException:
+        raise
+    except Exception as e:
+        database_logger.error(e)
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                            detail={"msg": "redis dead", })
+
+
+async def get_slices_redis(uuid, start, stop, metadata=None):
+    """Срезы [start, stop) (H x W x k): нужные куски тома - из L1, остальные одним MGET. None - промах."""
+    try:
+        redis = await redis_client.get_redis()
+        if metadata is None:
+            metadata = await get_metadata(uuid)
+
+        if metadata is None or 'chunk_size' not in metadata:
+            volume = await get_files_redis(uuid, metadata)
+            return None if volume is None else volume[:, :, start:stop]
+
+        chunk_size = metadata['chunk_size']
+        nums = range(start // chunk_size, (stop - 1) // chunk_size + 1)
+        chunks = {num: local_cache.get(('chunk', str(uuid), num)) for num in nums}
+        missing = [num for num, chunk in chunks.items() if chunk is None]
+        cache_metrics.local_hit('file', len(chunks) - len(missing))
+        if missing:
+            with cache_metrics.timed('file'):
+                replies = await redis.mget([chunk_key(uuid, num) for num in missing])
+            for num, data in zip(missing, replies):
+                if data is None:
+                    return await drop_evicted_volume(uuid)
+                cache_metrics.hit('file', len(data))
+                with cache_metrics.serializing('file'):
+                    chunks[num] = load_volume(data)
+                local_cache.set(('chunk', str(uuid), num), chunks[num])
+        volume = np.concatenate([chunks[num] for num in nums], axis=2)
+        offset = nums[0] * chunk_size
+        return volume[:, :, start - offset:stop - offset]
+    except HTTPException:
+        raise
     except Exception as e:
         database_logger.error(e)
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                             detail={"msg": "redis dead", })
 
 
+def _decode_slice_cached(kind, data):
+    if data is None:
+        return None
+    if kind == 'contours':
+        return _decode_contours(data)
+    # img / result: старые записи (pickle) считаем промахом
+    return data if data.startswith(PNG_SIGNATURE) else None
+
+
+async def get_slices_cached(kind, uuid, nums) -> list:
+    """
+    Записи {kind}:{uuid}:{n} (kind: contours | img | result) для всех nums:
+    сначала L1, остальное одним MGET. None на месте промаха.
+    """
+    uuid = str(uuid)
+    values = [local_cache.get((kind, uuid, num)) for num in nums]
+    missing = [i for i, value in enumerate(values) if value is None]
+    cache_metrics.local_hit(kind, len(values) - len(missing))
+    if not missing:
+        return values
+    try:
+        redis = await redis_client.get_redis()
+        with cache_metrics.timed(kind):
+            replies = await redis.mget([f'{kind}:{uuid}:{nums[i]}' for i in missing])
+    except Exception as e:
+        database_logger.error(e)
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                            detail={"msg": "redis dead", })
+    for i, data in zip(missing, replies):
+        with cache_metrics.serializing(kind):
+            value = _decode_slice_cached(kind, data)
+        if value is None:
+            cache_metrics.miss(kind)
+            continue
+        cache_metrics.hit(kind, len(data))
+        local_cache.set((kind, uuid, nums[i]), value)
+        values[i] = value
+    return values
+
+
+async def load_slices_cached(kind, uuid, items: dict):
+    """items: номер среза -> значение; одна запись пайплайном."""
+    with cache_metrics.serializing(kind):
+        encoded = {
+            f'{kind}:{uuid}:{num}': encode_contours(value) if kind == 'contours' else value
+            for num, value in items.items()
+        }
+    await redis_client.load_files_many(encoded)
+    for num, value in items.items():
+        local_cache.set((kind, str(uuid), num), value)
+
+
+_touched: dict[str, float] = {}
+
+
+async def touch_file(uuid, metadata):
+    """
+    Скользящий TTL: у тома, который сейчас читают, продлеваются куски и метаданные
+    (у дубликата - только его метаданные). Не чаще раза в REDIS_TOUCH_INTERVAL на процесс.
+    """
+    uuid = str(uuid)
+    now = time.monotonic()
+    if now - _touched.get(uuid, 0.0) < settings.REDIS_TOUCH_INTERVAL:
+        return
+    if len(_touched) > 4096:
+        _touched.clear()
+    _touched[uuid] = now
+
+    ttl = ttl_for('file')
+    try:
+        redis = await redis_client.get_redis()
+        pipe = redis.pipeline()
+        if 'storage_uuid' not in metadata:
+            if 'chunk_size' in metadata:
+                num_chunks = -(-(metadata['num_slices'] + 1) // metadata['chunk_size'])
+                for num_chunk in range(num_chunks):
+                    pipe.expire(chunk_key(uuid, num_chunk), ttl)
+            else:
+                pipe.expire(f'file:{uuid}', ttl)
+        pipe.expire(f'file_metadata:{uuid}', ttl - 1)
+        await pipe.execute()
+    except Exception as e:
+        database_logger.error(e)
+
+
+async def keyspace_stats(sample: int = 50) -> dict:
+    """
+    Число ключей, оценка объёма (MEMORY USAGE по выборке * число ключей)
+    и средний оставшийся TTL по семействам ключей. SCAN по всей базе - для отладки и мониторинга.
+    """
+    redis = await redis_client.get_redis()
+    families: dict[str, dict] = {}
+    async for key in redis.scan_iter(count=1000):
+        family = families.setdefault(keyspace(key), {'keys': 0, 'sample': []})
+        family['keys'] += 1
+        if len(family['sample']) < sample:
+            family['sample'].append(key)
+
+    stats = {}
+    for name, family in families.items():
+        pipe = redis.pipeline()
+        for key in family['sample']:
+            pipe.memory_usage(key)
+            pipe.pttl(key)
+        replies = await pipe.execute()
+        sizes = [size for size in replies[0::2] if size is not None]
+        ttls = [ttl for ttl in replies[1::2] if ttl is not None and ttl >= 0]
+        stats[name] = {
+            'keys': family['keys'],
+            'ttl_s': KEYSPACE_TTL.get(name, DEFAULT_TTL),
+            'avg_remaining_ttl_s': round(sum(ttls) / len(ttls) / 1000, 1) if ttls else None,
+            'avg_bytes': int(sum(sizes) / len(sizes)) if sizes else 0,
+            'est_bytes': int(sum(sizes) / len(sizes) * family['keys']) if sizes else 0,
+        }
+    return stats
+
+
+class KeyspaceStatsCache:
+    """
+    Снимок keyspace_stats, пересчитывается в фоне раз в interval секунд:
+    эндпоинт отдаёт готовый снимок и сам SCAN по базе не запускает.
+    """
+
+    def __init__(self, interval: int = settings.KEYSPACE_STATS_INTERVAL,
+                 sample: int = settings.KEYSPACE_STATS_SAMPLE):
+        self.interval = interval
+        self.sample = sample
+        self.snapshot: dict = {'computed_at': None, 'keyspaces': {}}
+        self._worker: asyncio.Task | None = None
+
+    def start(self):
+        if self._worker is None and self.interval > 0:
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    async def _run(self):
+        while True:
+            try:
+                self.snapshot = {'computed_at': time.time(), 'keyspaces': await keyspace_stats(self.sample)}
+            except Exception as e:
+                database_logger.error(e)
+            await asyncio.sleep(self.interval)
+
+
 redis_client = RedisClient()
+keyspace_stats_cache = KeyspaceStatsCache()
@@ -0,0 +1,41 @@
+import cv2
+import numpy as np
+
+# Красный в BGR
+CONTOUR_COLOR = (0, 0, 255)
+
+
+def encode_png(image: np.ndarray, compression: int = 3) -> bytes:
+    """uint8 (H x W) или BGR (H x W x 3) -> PNG. Без глобального состояния, можно звать из нескольких потоков."""
+    ok, buf = cv2.imencode('.png', image, [cv2.IMWRITE_PNG_COMPRESSION, compression])
+    if not ok:
+        raise ValueError(f"Could not encode image with shape {image.shape}")
+    return buf.tobytes()
+
+
+def to_gray_uint8(image: np.ndarray) -> np.ndarray:
+    """Растягивает значения среза на 0..255 (как imshow(cmap='gray') с автоматическими vmin/vmax)."""
+    image = np.asarray(image, dtype=np.float32)
+    low, high = float(image.min()), float(image.max())
+    if high <= low:
+        return np.zeros(image.shape, dtype=np.uint8)
+    return ((image - low) * (255.0 / (high - low))).astype(np.uint8)
+
+
+def render_gray(image: np.ndarray, compression: int = 3) -> bytes:
+    return encode_png(to_gray_uint8(image), compression)
+
+
+def render_overlay(image: np.ndarray, contours, compression: int = 3) -> bytes:
+    """
+    Срез в оттенках серого + контуры красной линией в 1 пиксель.
+    :param image: uint8 (H x W)
+    :param contours: [[ [x, y], [x2, y2], ... ], [ ... ], ...]
+    """
+    overlay = np.zeros((*image.shape, 3), dtype=np.uint8)
+    polylines = [np.asarray(contour, dtype=np.int32).reshape((-1, 1, 2)) for contour in contours if len(contour) >= 2]
+    if polylines:
+        cv2.polylines(overlay, polylines, isClosed=True, color=CONTOUR_COLOR, thickness=1)
+
+    combined = cv2.add(cv2.cvtColor(image, cv2.COLOR_GRAY2BGR), overlay)
+    return encode_png(combined, compression)
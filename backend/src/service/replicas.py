@@ -0,0 +1,145 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from src.logger import api_logger
+
+# Экземпляр модели внутри процесса-реплики
+_manager = None
+
+# nice для реплики фоновой полосы: ядра в первую очередь отдаются интерактивным репликам
+LOW_PRIORITY_NICE = 10
+
+
+def _init_replica(backend, num_threads, interop_threads, cores, png_compression, nice=0):
+    global _manager
+    import torch
+    from src.service.model import ModelSegmentationManager
+
+    if cores:
+        os.sched_setaffinity(0, cores)
+    if nice:
+        os.nice(nice)
+    torch.set_num_threads(num_threads)
+    torch.set_num_interop_threads(interop_threads)
+
+    _manager = ModelSegmentationManager(png_compression)
+    _manager.upload_model(backend, num_threads, interop_threads)
+
+
+def _call(method, *args, **kwargs):
+    return getattr(_manager, method)(*args, **kwargs)
+
+
+def _ping():
+    return os.getpid()
+
+
+def partition_cores(replicas, threads):
+    """Делит доступные процессу ядра на непересекающиеся блоки по threads ядер для каждой реплики."""
+    cores = sorted(os.sched_getaffinity(0))
+    if replicas * threads > len(cores):
+        raise RuntimeError(f"Not enough cores for {replicas} replicas x {threads} threads ({len(cores)} available)")
+    return [set(cores[i * threads:(i + 1) * threads]) for i in range(replicas)]
+
+
+class Replica:
+    def __init__(self, index, initargs):
+        self.index = index
+        self.initargs = initargs
+        self.in_flight = 0
+        self.pool = self._spawn()
+
+    def _spawn(self):
+        return ProcessPoolExecutor(
+            max_workers=1,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_replica,
+            initargs=self.initargs,
+        )
+
+    def restart(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        self.pool = self._spawn()
+
+
+class ReplicaPool:
+    """
+    Пул процессов с копиями модели. У каждой реплики фиксированное число потоков torch
+    (и при необходимости свой набор ядер), чтобы реплики не дрались за одни и те же ядра.
+    Запрос уходит в наименее загруженную реплику.
+    Фоновая работа (submit_low) идёт в отдельную однопоточную реплику с пониженным приоритетом
+    (на свободных от интерактивных реплик ядрах, если такие есть) и в общий выбор не попадает.
+    """
+
+    def __init__(self):
+        self.replicas: list[Replica] = []
+        self.low: Replica | None = None
+        self._lock = threading.Lock()
+
+    @property
+    def started(self) -> bool:
+        return bool(self.replicas)
+
+    def start(self, replicas, backend='eager', num_threads=1, interop_threads=1, pin_cores=False,
+              png_compression=3):
+        if self.started:
+            return
+        cores = partition_cores(replicas, num_threads) if pin_cores else [None] * replicas
+        self.replicas = [Replica(i, (backend, num_threads, interop_threads, cores[i], png_compression))
+                         for i in range(replicas)]
+        spare = set(os.sched_getaffinity(0)).difference(*cores) if pin_cores else set()
+        self.low = Replica('low', (backend, 1, 1, spare or None, png_compression, LOW_PRIORITY_NICE))
+        # Процесс и модель поднимаются при первой задаче - ждём, пока все реплики будут готовы
+        for replica in [*self.replicas, self.low]:
+            replica.pool.submit(_ping).result()
+        print(f'✅ Started {replicas} model replicas ({num_threads} threads each, pinned={pin_cores}) + low-priority replica')
+
+    def shutdown(self):
+        for replica in [*self.replicas, self.low] if self.low else self.replicas:
+            replica.pool.shutdown(wait=True, cancel_futures=True)
+        self.replicas = []
+        self.low = None
+
+    def _pick(self) -> Replica:
+        with self._lock:
+            replica = min(self.replicas, key=lambda r: r.in_flight)
+            replica.in_flight += 1
+            return replica
+
+    def _done(self, replica: Replica):
+        with self._lock:
+            replica.in_flight -= 1
+
+    def submit(self, method, *args, **kwargs):
+        """Возвращает concurrent.futures.Future с результатом ModelSegmentationManager.<method>(*args)."""
+        return self._submit_to(self._pick(), method, *args, **kwargs)
+
+    def submit_low(self, method, *args, **kwargs):
+        """Как submit, но в реплику фоновой полосы; число задач в ней ограничивает вызывающий."""
+        with self._lock:
+            self.low.in_flight += 1
+        return self._submit_to(self.low, method, *args, **kwargs)
+
+    def _submit_to(self, replica: Replica, method, *args, **kwargs):
+        try:
+            try:
+                future = replica.pool.submit(_call, method, *args, **kwargs)
+            except BrokenProcessPool:
+                api_logger.error("Model replica died, restarting", extra={"replica": replica.index})
+                replica.restart()
+                future = replica.pool.submit(_call, method, *args, **kwargs)
+        except Exception:
+            self._done(replica)
+            raise
+        future.add_done_callback(lambda _: self._done(replica))
+        return future
+
+    async def run(self, method, *args, **kwargs):
+        return await asyncio.wrap_future(self.submit(method, *args, **kwargs))
+
+
+replica_pool = ReplicaPool()
@@ -1,5 +1,6 @@
-
-from contextlib import asynccontextmanager
+import asyncio
+from contextlib import asynccontextmanager, AsyncExitStack
+from aiobotocore.config import AioConfig
 from aiobotocore.session import get_session
 from botocore.exceptions import ClientError
 from fastapi import HTTPException, status
@@ -7,12 +8,20 @@ from fastapi import HTTPException, status
 from src.config import settings
 from src.logger import s3_logger
 
+NOT_FOUND_CODES = ('404', 'NoSuchKey', 'NotFound')
 
 
 class S3Client:
+    """
+    Один долгоживущий клиент на процесс: пул соединений и TLS-сессии переиспользуются
+    между запросами. Создаётся в connect (lifespan), закрывается в close.
+    """
+
     def __init__(self):
         self._config = None
         self._session = None
+        self._client = None
+        self._exit_stack = None
 
     async def connect(
             self,
@@ -20,20 +29,49 @@ class S3Client:
             secret_key: str,
             endpoint_url: str,
             region_name: str,
+            max_pool_connections: int = 10,
+            keepalive_timeout: int = 60,
+            connect_timeout: int = 5,
+            read_timeout: int = 60,
+            max_attempts: int = 5,
+            retry_mode: str = 'adaptive',
     ) -> None:
         self._config = {
             "aws_access_key_id": access_key,
             "aws_secret_access_key": secret_key,
             "endpoint_url": endpoint_url,
             "region_name": region_name,
+            "config": AioConfig(
+                max_pool_connections=max_pool_connections,
+                connect_timeout=connect_timeout,
+                read_timeout=read_timeout,
+                retries={"max_attempts": max_attempts, "mode": retry_mode},
+                tcp_keepalive=True,
+                connector_args={"keepalive_timeout": keepalive_timeout},
+            ),
         }
         self._session = get_session()
-        await self._test_connection()
+        self._exit_stack = AsyncExitStack()
+        self._client = await self._exit_stack.enter_async_context(
+            self._session.create_client("s3", **self._config)
+        )
+        try:
+            await self._test_connection()
+        except Exception:
+            await self.close()
+            raise
+
+    async def close(self) -> None:
+        if self._exit_stack is not None:
+            await self._exit_stack.aclose()
+            self._exit_stack = None
+            self._client = None
 
     @asynccontextmanager
     async def _get_client(self):
-        async with self._session.create_client("s3", **self._config) as client:
-            yield client
+        if self._client is None:
+            raise RuntimeError("S3 client is not connected")
+        yield self._client
 
     async def upload_file(
             self,
@@ -42,19 +80,24 @@ class S3Client:
             bucket_name,
             request_id,
     ) -> None:
+        """file_obj - bytes или файловый объект (читается с текущей позиции)."""
+        file_size = _body_size(file_obj)
         try:
             async with self._get_client() as client:
-                await client.put_object(
-                    Bucket=bucket_name,
-                    Key=obj_name,
-                    Body=file_obj
-                )
+                if file_size is not None and file_size >= settings.S3_MULTIPART_THRESHOLD:
+                    await self._upload_multipart(client, file_obj, obj_name, bucket_name)
+                else:
+                    await client.put_object(
+                        Bucket=bucket_name,
+                        Key=obj_name,
+                        Body=file_obj
+                    )
             s3_logger.info(
                 "File uploaded to S3 successfully",
                 extra={
                     "object_name": obj_name,
                     "bucket": bucket_name,
-                    "file_size": len(file_obj) if hasattr(file_obj, '__len__') else None,
+                    "file_size": file_size,
                     "request_id": request_id,
                 }
             )
@@ -71,6 +114,53 @@ class S3Client:
             )
             raise
 
+    @staticmethod
+    async def _upload_multipart(client, file_obj, obj_name, bucket_name) -> None:
+        """
+        Части по S3_MULTIPART_PART_SIZE, одновременно не больше S3_MULTIPART_CONCURRENCY
+        (столько же частей держится в памяти). При ошибке загрузка отменяется (abort).
+        """
+        upload = await client.create_multipart_upload(Bucket=bucket_name, Key=obj_name)
+        upload_id = upload['UploadId']
+        semaphore = asyncio.Semaphore(settings.S3_MULTIPART_CONCURRENCY)
+
+        async def upload_part(part_number, body):
+            try:
+                response = await client.upload_part(
+                    Bucket=bucket_name,
+                    Key=obj_name,
+                    UploadId=upload_id,
+                    PartNumber=part_number,
+                    Body=body
+                )
+                return {'PartNumber': part_number, 'ETag': response['ETag']}
+            finally:
+                semaphore.release()
+
+        tasks = []
+        try:
+            part_number = 0
+            async for body in _iter_parts(file_obj, settings.S3_MULTIPART_PART_SIZE):
+                part_number += 1
+                await semaphore.acquire()
+                for task in tasks:
+                    if task.done() and task.exception() is not None:
+                        raise task.exception()
+                tasks.append(asyncio.create_task(upload_part(part_number, body)))
+            parts = await asyncio.gather(*tasks)
+            await client.complete_multipart_upload(
+                Bucket=bucket_name,
+                Key=obj_name,
+                UploadId=upload_id,
+                MultipartUpload={'Parts': parts}
+            )
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await client.abort_multipart_upload(Bucket=bucket_name, Key=obj_name, UploadId=upload_id)
+            raise
+
     async def _test_connection(self) -> None:
         try:
             async with self._get_client() as client:
@@ -90,12 +180,18 @@ class S3Client:
             obj_name,
             bucket_name,
             request_id,
+            byte_range: tuple[int, int] | None = None,
     ) -> bytes:
+        """byte_range - [start, end) для ranged GET, None - объект целиком."""
         try:
             async with self._get_client() as client:
+                params = {}
+                if byte_range is not None:
+                    params['Range'] = f"bytes={byte_range[0]}-{byte_range[1] - 1}"
                 response = await client.get_object(
                     Bucket=bucket_name,
-                    Key=obj_name
+                    Key=obj_name,
+                    **params
                 )
                 data = await response['Body'].read()
                 s3_logger.info(
@@ -104,11 +200,25 @@ class S3Client:
                         "object_name": obj_name,
                         "bucket": bucket_name,
                         "file_size": len(data),
+                        "byte_range": byte_range,
                         "request_id": request_id,
                     }
                 )
                 return data
         except ClientError as e:
+            if e.response.get('Error', {}).get('Code') not in NOT_FOUND_CODES:
+                # 5xx, отказ в доступе и т.п. - не "нет объекта", вызывающий решает сам
+                s3_logger.error(
+                    "Failed to download file from S3",
+                    exc_info=e,
+                    extra={
+                        "object_name": obj_name,
+                        "bucket": bucket_name,
+                        "error": str(e),
+                        "request_id": request_id,
+                    }
+                )
+                raise
             s3_logger.warning(
                 "File not found in S3",
                 extra={
@@ -132,6 +242,42 @@ class S3Client:
             )
             raise
 
+    async def exists(
+            self,
+            obj_name,
+            bucket_name,
+            request_id,
+    ) -> bool:
+        """HEAD объекта; любая ошибка кроме 404 логируется и считается отсутствием."""
+        try:
+            async with self._get_client() as client:
+                await client.head_object(Bucket=bucket_name, Key=obj_name)
+                return True
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') not in NOT_FOUND_CODES:
+                s3_logger.warning(
+                    "Failed to check object in S3",
+                    extra={
+                        "object_name": obj_name,
+                        "bucket": bucket_name,
+                        "error": str(e),
+                        "request_id": request_id,
+                    }
+                )
+            return False
+        except Exception as e:
+            s3_logger.error(
+                "Failed to check object in S3",
+                exc_info=e,
+                extra={
+                    "object_name": obj_name,
+                    "bucket": bucket_name,
+                    "error": str(e),
+                    "request_id": request_id,
+                }
+            )
+            return False
+
     async def delete_file(
             self,
             obj_name,
@@ -179,5 +325,26 @@ class S3Client:
             )
 
 
+def _body_size(file_obj) -> int | None:
+    if hasattr(file_obj, '__len__'):
+        return len(file_obj)
+    if hasattr(file_obj, 'seek'):
+        position = file_obj.tell()
+        size = file_obj.seek(0, 2)
+        file_obj.seek(position)
+        return size - position
+    return None
+
+
+async def _iter_parts(file_obj, part_size: int):
+    """Части тела; файл (spooled / на диске) читается в потоке, а не на event loop."""
+    if hasattr(file_obj, 'read'):
+        while part := await asyncio.to_thread(file_obj.read, part_size):
+            yield part
+    else:
+        for start in range(0, len(file_obj), part_size):
+            yield file_obj[start:start + part_size]
+
+
 s3_client = S3Client()
 
@@ -0,0 +1,106 @@
+import asyncio
+import time
+import uuid
+
+from src.config import settings
+from src.logger import database_logger
+from src.service.redis_conn import redis_client
+
+# Снять lease только если он всё ещё наш (мог истечь и достаться другому воркеру)
+RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+# Продлить lease, пока он наш
+RENEW_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+
+class SingleFlight:
+    """
+    Один расчёт на ключ кэша при одновременных промахах.
+    В процессе - одна задача на ключ, остальные ждут её результат.
+    Между воркерами - короткий lease в Redis (lock:{key}, SET NX PX): кто не взял lease,
+    опрашивает EXISTS ключа кэша (cache_key, по умолчанию сам key) без метрик, пока держатель
+    не запишет результат, и читает его одним get_cached - один hit/miss на запрос; если держатель пропал
+    (lease истёк без записи) или ждать дольше wait_s - считает сам.
+    Пока расчёт идёт, держатель продлевает lease, так что долгий расчёт не считается пропавшим.
+    Ошибки Redis при ожидании - тоже повод посчитать самому.
+    compute должен сам записать результат в кэш до возврата.
+    """
+
+    def __init__(self, lease_ms: int = settings.SINGLE_FLIGHT_LEASE_MS,
+                 wait_s: float = settings.SINGLE_FLIGHT_WAIT_S,
+                 poll_ms: int = settings.SINGLE_FLIGHT_POLL_MS):
+        self.lease_ms = lease_ms
+        self.wait_s = wait_s
+        self.poll_s = poll_ms / 1000
+        self._inflight: dict[str, asyncio.Task] = {}
+
+    async def run(self, key: str, compute, get_cached, cache_key: str | None = None):
+        """compute, get_cached - async-функции без аргументов; get_cached возвращает None при промахе."""
+        task = self._inflight.get(key)
+        if task is None:
+            # Отдельная задача: отмена запроса-инициатора не обрывает расчёт для остальных
+            task = asyncio.create_task(self._leased(key, compute, get_cached, cache_key or key))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def _leased(self, key, compute, get_cached, cache_key):
+        lock_key = f'lock:{key}'
+        token = uuid.uuid4().hex
+        try:
+            redis = await redis_client.get_redis()
+            acquired = await redis.set(lock_key, token, nx=True, px=self.lease_ms)
+        except Exception as e:
+            database_logger.error(e)
+            return await compute()
+
+        if acquired:
+            renew = asyncio.create_task(self._renew(redis, lock_key, token))
+            try:
+                return await compute()
+            finally:
+                renew.cancel()
+                try:
+                    await redis.eval(RELEASE_SCRIPT, 1, lock_key, token)
+                except Exception as e:
+                    database_logger.error(e)
+
+        try:
+            deadline = time.monotonic() + self.wait_s
+            while time.monotonic() < deadline:
+                await asyncio.sleep(self.poll_s)
+                pipe = redis.pipeline()
+                pipe.exists(cache_key)
+                pipe.exists(lock_key)
+                cached, locked = await pipe.execute()
+                # Результат записан, либо держатель закончил без результата или упал - читаем и, если нет, считаем сами
+                if cached or not locked:
+                    break
+            value = await get_cached()
+        except Exception as e:
+            database_logger.error(e)
+            value = None
+        return value if value is not None else await compute()
+
+    async def _renew(self, redis, lock_key, token):
+        """Продлевать lease каждую треть lease_ms, пока идёт расчёт."""
+        while True:
+            await asyncio.sleep(self.lease_ms / 3000)
+            try:
+                if not await redis.eval(RENEW_SCRIPT, 1, lock_key, token, self.lease_ms):
+                    return
+            except Exception as e:
+                database_logger.error(e)
+
+
+single_flight = SingleFlight()
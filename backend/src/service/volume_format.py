@@ -0,0 +1,146 @@
+import io
+import pickle
+import struct
+
+import numpy as np
+
+# Бинарный формат обработанного тома (вместо pickle):
+#   заголовок на HEADER_SIZE байт: magic, version, ndim, layout, dtype ('<f4'), shape, spacing
+#   + сырые данные массива.
+# Заголовок выровнен до 64 байт, чтобы np.frombuffer отдавал выровненный массив без копии.
+# layout: LAYOUT_C - массив H x W x depth в C-порядке (v1, куски тома в Redis),
+#         LAYOUT_SLICES - срезы подряд (depth x H x W), срез n - непрерывный диапазон байт (slice_range),
+#         так что из S3 его можно прочитать ranged GET'ом, не скачивая том.
+MAGIC = b'LVOL'
+VERSION = 2
+SUPPORTED_VERSIONS = (1, 2)
+HEADER = struct.Struct('<4sBBB1x8s3I3f')
+HEADER_SIZE = 64
+LAYOUT_C = 0
+LAYOUT_SLICES = 1
+
+# Нормализованный в [0, 1] том можно хранить с пониженной точностью:
+# uint16 - значение * 65535, float16 - как есть. Обратно в float32 - dequantize() перед моделью.
+STORAGE_DTYPES = ('float32', 'float16', 'uint16')
+UINT16_SCALE = 65535.0
+
+
+def quantize_volume(volume: np.ndarray, dtype: str = 'float32') -> np.ndarray:
+    if dtype not in STORAGE_DTYPES:
+        raise ValueError(f"Unknown storage dtype '{dtype}', expected one of {STORAGE_DTYPES}")
+    if volume.dtype == np.dtype(dtype):
+        return volume
+    # Том уже в другом типе хранения (например, из S3 при смене VOLUME_STORAGE_DTYPE) - сначала в [0, 1]
+    volume = dequantize(volume)
+    if dtype == 'uint16':
+        return np.rint(np.clip(volume, 0.0, 1.0) * UINT16_SCALE).astype(np.uint16)
+    return volume.astype(dtype)
+
+
+def dequantize(array: np.ndarray) -> np.ndarray:
+    """Срез или том из хранилища -> float32 в [0, 1]."""
+    if array.dtype == np.uint16:
+        return array.astype(np.float32) * np.float32(1.0 / UINT16_SCALE)
+    if array.dtype != np.float32:
+        return array.astype(np.float32)
+    return array
+
+
+def dump_volume(volume: np.ndarray, spacing=(1.0, 1.0, 1.0), dtype: str | None = None,
+                layout: int = LAYOUT_C) -> bytes:
+    """dtype - тип хранения (STORAGE_DTYPES), None - как есть; layout - LAYOUT_C или LAYOUT_SLICES."""
+    if dtype is not None:
+        volume = quantize_volume(volume, dtype)
+    if volume.ndim != 3:
+        raise ValueError(f"Expected 3D volume, got shape {volume.shape}")
+    shape = volume.shape
+    data = np.ascontiguousarray(volume if layout == LAYOUT_C else np.moveaxis(volume, 2, 0))
+    header = HEADER.pack(MAGIC, VERSION, volume.ndim, layout, data.dtype.str.encode(), *shape, *spacing)
+    return header.ljust(HEADER_SIZE, b'\0') + data.tobytes()
+
+
+def create_volume_file(path, shape: tuple[int, int, int], dtype: str, spacing=(1.0, 1.0, 1.0)) -> np.ndarray:
+    """
+    LVOL с LAYOUT_SLICES нужного размера на диске; возвращает H x W x depth поверх np.memmap для записи.
+    Том заполняется по кускам и не держится в памяти процесса целиком - страницы принадлежат файлу.
+    """
+    height, width, depth = shape
+    dtype = np.dtype(dtype)
+    header = HEADER.pack(MAGIC, VERSION, 3, LAYOUT_SLICES, dtype.str.encode(), *shape, *spacing)
+    with open(path, 'wb') as file:
+        file.write(header.ljust(HEADER_SIZE, b'\0'))
+        file.truncate(HEADER_SIZE + height * width * depth * dtype.itemsize)
+    array = np.memmap(path, dtype=dtype, mode='r+', offset=HEADER_SIZE, shape=(depth, height, width))
+    return np.moveaxis(array, 0, 2)
+
+
+def read_header(data) -> tuple[np.dtype, tuple[int, ...], tuple[float, ...]]:
+    dtype, shape, spacing, _ = read_header_layout(data)
+    return dtype, shape, spacing
+
+
+def read_header_layout(data) -> tuple[np.dtype, tuple[int, ...], tuple[float, ...], int]:
+    """Как read_header, плюс layout (у v1 всегда LAYOUT_C)."""
+    magic, version, ndim, layout, dtype, *rest = HEADER.unpack_from(data)
+    if magic != MAGIC or version not in SUPPORTED_VERSIONS:
+        raise ValueError(f"Unknown volume format {magic!r} v{version}")
+    if layout not in (LAYOUT_C, LAYOUT_SLICES):
+        raise ValueError(f"Unknown volume layout {layout}")
+    return np.dtype(dtype.rstrip(b'\0').decode()), tuple(rest[:ndim]), tuple(rest[3:]), layout
+
+
+def slice_range(num_slice: int, dtype: np.dtype, shape: tuple[int, ...]) -> tuple[int, int]:
+    """Байтовый диапазон [start, end) среза num_slice внутри тома с LAYOUT_SLICES."""
+    height, width, depth = shape
+    if not 0 <= num_slice < depth:
+        raise IndexError(f"Slice {num_slice} out of range 0..{depth - 1}")
+    nbytes = height * width * dtype.itemsize
+    start = HEADER_SIZE + num_slice * nbytes
+    return start, start + nbytes
+
+
+def load_slice(data, dtype: np.dtype, shape: tuple[int, ...]) -> np.ndarray:
+    """Срез H x W из байт, прочитанных по slice_range."""
+    return np.frombuffer(data, dtype=dtype, count=shape[0] * shape[1]).reshape(shape[:2])
+
+
+def load_volume(data) -> np.ndarray:
+    """
+    Массив H x W x depth поверх переданного буфера, без копирования (только для чтения, если data - bytes).
+    Для LAYOUT_SLICES это view с переставленными осями.
+    """
+    dtype, shape, _, layout = read_header_layout(data)
+    count = int(np.prod(shape))
+    if layout == LAYOUT_SLICES:
+        height, width, depth = shape
+        array = np.frombuffer(data, dtype=dtype, count=count, offset=HEADER_SIZE)
+        return np.moveaxis(array.reshape(depth, height, width), 0, 2)
+    return np.frombuffer(data, dtype=dtype, count=count, offset=HEADER_SIZE).reshape(shape)
+
+
+def is_volume(data) -> bool:
+    return bytes(data[:len(MAGIC)]) == MAGIC
+
+
+class _NumpyUnpickler(pickle.Unpickler):
+    """Для старых .processed: разрешаем только то, что нужно для восстановления ndarray."""
+    allowed = {
+        ('numpy', 'ndarray'), ('numpy', 'dtype'),
+        ('numpy.core.multiarray', '_reconstruct'), ('numpy.core.multiarray', 'scalar'),
+        ('numpy._core.multiarray', '_reconstruct'), ('numpy._core.multiarray', 'scalar'),
+        # Протоколы 0-2 кодируют байты через _codecs.encode, протокол 5 собирает массив через _frombuffer
+        ('_codecs', 'encode'),
+        ('numpy.core.numeric', '_frombuffer'), ('numpy._core.numeric', '_frombuffer'),
+    }
+
+    def find_class(self, module, name):
+        if (module, name) not in self.allowed:
+            raise pickle.UnpicklingError(f"Forbidden global {module}.{name} in legacy volume")
+        return super().find_class(module, name)
+
+
+def load_volume_any(data) -> np.ndarray:
+    """Новый формат, либо старый pickle с ndarray (файлы, загруженные до перехода на LVOL)."""
+    if is_volume(data):
+        return load_volume(data)
+    return _NumpyUnpickler(io.BytesIO(data)).load()
@@ -0,0 +1,205 @@
+import asyncio
+
+import numpy as np
+
+from src.config import settings
+from src.logger import api_logger
+from src.service.batcher import segmentation_batcher
+from src.service.inference import inference_executor
+from src.service.masks import pack_masks
+from src.service.model import modelManager
+from src.service.redis_conn import (
+    load_contours_volume_cached, load_result_cached, load_clear_photo, load_derivatives_progress,
+    get_contours_cached, load_contours_cached, get_result_cached,
+    get_slices_cached, load_slices_cached, get_slices_redis,
+)
+from src.service.single_flight import single_flight
+from src.utils.mask_volume import upload_mask_volume, get_contours_from_mask, get_mask_volume
+from src.utils.file import load_volume_cold
+from src.service.contours import mask_to_polygons
+from src.service.masks import unpack_slice
+
+
+async def get_slice_contours(data_uuid, num_slice, load_image, request_id):
+    """
+    Контуры среза: кэш, иначе сохранённый том масок, иначе модель.
+    Одновременные промахи по одному срезу (в процессе и между воркерами) считаются один раз.
+    load_image - async-функция, возвращающая тензор среза (нужен только при расчёте).
+    """
+    contours = await get_contours_cached(data_uuid, num_slice)
+    if contours is not None:
+        return contours
+
+    async def compute():
+        contours = await get_contours_from_mask(data_uuid, num_slice, request_id)
+        if contours is None:
+            contours = await segmentation_batcher.submit(await load_image(), request_id=request_id)
+        await load_contours_cached(data_uuid, num_slice, contours)
+        return contours
+
+    return await single_flight.run(f'contours:{data_uuid}:{num_slice}', compute,
+                                   lambda: get_contours_cached(data_uuid, num_slice))
+
+
+async def get_slice_result(data_uuid, num_slice, image, contours, request_id):
+    """PNG среза с контурами модели: кэш, иначе одна отрисовка на срез (single-flight)."""
+    async def compute():
+        result_img = await inference_executor.run(modelManager.create_photo_with_contours, image, contours,
+                                                  request_id=request_id)
+        await load_result_cached(data_uuid, num_slice, result_img)
+        return result_img
+
+    return await single_flight.run(f'result:{data_uuid}:{num_slice}', compute,
+                                   lambda: get_result_cached(data_uuid, num_slice))
+
+
+def _batches(nums, batch_size):
+    for i in range(0, len(nums), batch_size):
+        yield nums[i:i + batch_size]
+
+
+async def get_range_contours(data_uuid, start, stop, load_slices, request_id) -> list:
+    """
+    Контуры срезов [start, stop): кэш одним MGET, промахи - из тома масок,
+    оставшиеся - через модель батчами по SEGMENT_BATCH_SIZE.
+    load_slices(a, b) - async-функция, возвращающая срезы [a, b) (H x W x k).
+    """
+    nums = list(range(start, stop))
+    contours = dict(zip(nums, await get_slices_cached('contours', data_uuid, nums)))
+    missing = [num for num, value in contours.items() if value is None]
+    if not missing:
+        return [contours[num] for num in nums]
+
+    computed = {}
+    packed = await get_mask_volume(data_uuid, request_id)
+    if packed is not None:
+        try:
+            for num in missing:
+                computed[num] = mask_to_polygons(unpack_slice(packed, num))
+        except (ValueError, IndexError):
+            computed.clear()
+
+    rest = [num for num in missing if num not in computed]
+    if rest:
+        volume = await load_slices(rest[0], rest[-1] + 1)
+        for batch in _batches(rest, settings.SEGMENT_BATCH_SIZE):
+            images = volume[:, :, [num - rest[0] for num in batch]]
+            _, batch_contours = await inference_executor.run(modelManager.segment_volume, images, len(batch),
+                                                             request_id=request_id)
+            computed.update(zip(batch, batch_contours))
+
+    await load_slices_cached('contours', data_uuid, computed)
+    contours.update(computed)
+    return [contours[num] for num in nums]
+
+
+async def get_range_photos(data_uuid, start, stop, load_slices, request_id) -> list:
+    """PNG срезов [start, stop) без контуров: кэш одним MGET, промахи рендерятся батчами."""
+    nums = list(range(start, stop))
+    photos = dict(zip(nums, await get_slices_cached('img', data_uuid, nums)))
+    missing = [num for num, value in photos.items() if value is None]
+    if missing:
+        computed = {}
+        volume = await load_slices(missing[0], missing[-1] + 1)
+        for batch in _batches(missing, settings.SEGMENT_BATCH_SIZE):
+            images = volume[:, :, [num - missing[0] for num in batch]]
+            computed.update(zip(batch, await inference_executor.run(modelManager.get_photos, images,
+                                                                    request_id=request_id)))
+        await load_slices_cached('img', data_uuid, computed)
+        photos.update(computed)
+    return [photos[num] for num in nums]
+
+
+class DerivativePipeline:
+    """
+    Фоновый расчёт производных сразу после загрузки: контуры, img- и result-PNG всех срезов.
+    Модель идёт окнами по batch_size срезов, отрисовка - не больше concurrency срезов одновременно,
+    одновременно обрабатывается не больше max_files файлов.
+    Всё считается в низкоприоритетной полосе inference_executor.run_low: при занятой модели
+    производные ждут, а не отбирают слоты у интерактивных запросов.
+    Прогресс пишется в Redis (derivatives:{uuid}), маски тома - в S3, как после segment-volume.
+    Срезы окна читаются из Redis (при вытеснении - с диска / из S3), том в памяти не держится.
+    """
+
+    def __init__(self, concurrency: int = settings.DERIVATIVES_CONCURRENCY,
+                 max_files: int = settings.DERIVATIVES_MAX_FILES,
+                 batch_size: int = settings.SEGMENT_BATCH_SIZE):
+        self.concurrency = concurrency
+        self.max_files = max_files
+        self.batch_size = batch_size
+        self._files: asyncio.Semaphore | None = None
+        self._tasks: dict[str, asyncio.Task] = {}
+
+    def start(self, file_uuid, depth: int, request_id):
+        """depth - число срезов тома, уже записанного в Redis под file_uuid."""
+        file_uuid = str(file_uuid)
+        if self._files is None:
+            self._files = asyncio.Semaphore(self.max_files)
+        if file_uuid in self._tasks:
+            return
+        task = asyncio.create_task(self._run(file_uuid, depth, request_id))
+        self._tasks[file_uuid] = task
+        task.add_done_callback(lambda _: self._tasks.pop(file_uuid, None))
+
+    async def stop(self):
+        for task in list(self._tasks.values()):
+            task.cancel()
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+
+    @staticmethod
+    async def _load_window(file_uuid, start, stop, request_id):
+        window = await get_slices_redis(file_uuid, start, stop)
+        if window is None:
+            volume, _ = await load_volume_cold(file_uuid, request_id)
+            window = volume[:, :, start:stop]
+        return window
+
+    async def _render(self, file_uuid, image_slice, num, contours, semaphore, request_id):
+        async with semaphore:
+            result_img, photo = await inference_executor.run_low(modelManager.render_slice, image_slice, contours,
+                                                                 request_id=request_id)
+            await load_result_cached(file_uuid, num, result_img)
+            await load_clear_photo(file_uuid, num, photo)
+
+    async def _run(self, file_uuid, depth, request_id):
+        done = 0
+        await load_derivatives_progress(file_uuid, 'queued', done, depth)
+        try:
+            async with self._files:
+                semaphore = asyncio.Semaphore(self.concurrency)
+                masks = []
+                for start in range(0, depth, self.batch_size):
+                    stop = min(start + self.batch_size, depth)
+                    window = await self._load_window(file_uuid, start, stop, request_id)
+                    batch_masks, contours = await inference_executor.run_low(
+                        modelManager.segment_volume, window, self.batch_size,
+                        request_id=request_id
+                    )
+                    masks.append(batch_masks)
+                    await load_contours_volume_cached(file_uuid, contours, start)
+                    await asyncio.gather(*(
+                        self._render(file_uuid, window[:, :, i], start + i, slice_contours, semaphore, request_id)
+                        for i, slice_contours in enumerate(contours)
+                    ))
+                    done = stop
+                    await load_derivatives_progress(file_uuid, 'running', done, depth)
+
+                packed = await asyncio.to_thread(lambda: pack_masks(np.concatenate(masks)))
+                await upload_mask_volume(file_uuid, packed, request_id)
+            await load_derivatives_progress(file_uuid, 'done', depth, depth)
+            api_logger.info(
+                "Derivatives generated",
+                extra={"file_uuid": file_uuid, "num_slices": depth, "request_id": request_id}
+            )
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            api_logger.error(
+                "Failed to generate derivatives",
+                exc_info=e,
+                extra={"file_uuid": file_uuid, "error": str(e), "request_id": request_id}
+            )
+            await load_derivatives_progress(file_uuid, 'failed', done, depth)
+
+
+derivative_pipeline = DerivativePipeline()
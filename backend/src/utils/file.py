@@ -1,52 +1,220 @@
-import io
-import pickle
-
 from fastapi import HTTPException, status
 
 from src.config import settings
 from src.db.manager_files import fileManager
 from src.logger import api_logger
-from src.service.redis_conn import get_metadata, get_files_redis, load_files_redis
+from src.service.disk_cache import disk_cache
+from src.service.redis_conn import (
+    get_metadata, get_files_redis, get_slice_redis, get_slices_redis,
+    load_files_redis, load_alias_metadata, touch_file, is_file_cached,
+)
 from src.service.s3 import s3_client
+from src.service.single_flight import single_flight
+from src.service.volume_format import (
+    load_volume_any, read_header, read_header_layout, is_volume,
+    slice_range, load_slice, HEADER_SIZE, LAYOUT_SLICES,
+)
 
 
-async def get_file_bytes(file_uuid, session, request_id, num_images: int = 0,
-                         user_id: str = '', metadata=None, background_task=None) -> bytes:
-    if metadata is None:
-        metadata = await get_metadata(file_uuid)
-    if metadata:
-        if metadata['is_public'] == True or metadata['author_id'] == user_id:
-            if num_images > metadata['num_slices']:
-                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
-                                    detail={"msg": 'num_images > num_slices in file', 'request_id': request_id})
-
-            file_bytes = await get_files_redis(file_uuid)
-        else:
-            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail={"msg": "Not public file",
-                                                                               'request_id': request_id})
+def processed_obj_name(file_uuid) -> str:
+    return f"files/{file_uuid}.nii.processed"
+
+
+def check_access(metadata, num_images, user_id, request_id):
+    if not (metadata['is_public'] == True or metadata['author_id'] == user_id):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail={"msg": "Not public file",
+                                                                           'request_id': request_id})
+    if num_images > metadata['num_slices']:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail={"msg": 'num_images > num_slices in file', 'request_id': request_id})
+
+
+async def check_file_access(session, file_uuid, metadata, user_id, request_id, num_images=0):
+    """check_access по метаданным из Redis, а при их промахе - по строке Files в БД."""
+    if not metadata:
+        file_db = await fileManager.get_metafile(session, file_uuid, num_images, request_id)
+        metadata = {'is_public': file_db.is_public, 'author_id': str(file_db.author_id),
+                    'num_slices': file_db.num_slices}
+    check_access(metadata, num_images, user_id, request_id)
+
+
+async def download_processed_s3(file_uuid, request_id) -> bytes:
+    return await s3_client.download_file(
+        processed_obj_name(file_uuid),
+        settings.S3_PRIVATE_BUCKET_NAME,
+        request_id
+    )
+
+
+def decode_processed(s3_file_bytes):
+    spacing = read_header(s3_file_bytes)[2] if is_volume(s3_file_bytes) else (1.0, 1.0, 1.0)
+    return load_volume_any(s3_file_bytes), spacing
+
+
+async def load_volume_cold(file_uuid, request_id, background_task=None):
+    """Том мимо Redis: сначала локальный дисковый кэш, потом S3 (с записью на диск в фоне)."""
+    cached = await disk_cache.get_volume(file_uuid)
+    if cached is not None:
+        return cached
+
+    api_logger.info(
+        "Cache miss: loading file from S3",
+        extra={
+            "file_uuid": file_uuid,
+            "request_id": request_id,
+        }
+    )
+    s3_file_bytes = await download_processed_s3(file_uuid, request_id)
+    if background_task:
+        background_task.add_task(disk_cache.put, file_uuid, s3_file_bytes)
     else:
+        await disk_cache.put(file_uuid, s3_file_bytes)
+    return decode_processed(s3_file_bytes)
+
+
+def storage_of(file_uuid, metadata) -> str:
+    """uuid, под которым лежат данные файла: свой или исходной загрузки для дубликата."""
+    return (metadata or {}).get('storage_uuid') or str(file_uuid)
+
+
+async def resolve_storage(file_uuid, metadata, session) -> str:
+    """
+    storage_of с запасным путём: метаданных в Redis нет (холодный дубликат) - storage_uuid берётся из БД,
+    иначе производные, маска и prefetch дубликата шли бы под его собственным uuid.
+    """
+    if metadata:
+        return storage_of(file_uuid, metadata)
+    return await fileManager.get_storage_uuid(session, file_uuid)
+
+
+async def warm_file_redis(file_db, storage_db, request_id, volume=None, spacing=None):
+    """
+    Фоново: весь том (с диска или из S3) в Redis под storage_db.uuid, чтобы следующие срезы
+    читались уже из кэша; для дубликата - ещё и его собственные метаданные.
+    Промахи по многим срезам ставят много таких задач - том грузится один раз (single-flight
+    по storage_db.uuid), остальные видят, что он уже в Redis.
+    """
+    async def compute():
+        nonlocal volume, spacing
+        if volume is None:
+            volume, spacing = await load_volume_cold(storage_db.uuid, request_id)
+        await load_files_redis(storage_db.uuid, volume, storage_db.num_slices,
+                               str(storage_db.author_id), storage_db.is_public, spacing)
+        return True
+
+    if await is_file_cached(storage_db.uuid) is None:
+        await single_flight.run(f'warm:{storage_db.uuid}', compute, lambda: is_file_cached(storage_db.uuid),
+                                cache_key=f'file_metadata:{storage_db.uuid}')
+    if file_db is not storage_db:
+        await load_alias_metadata(file_db.uuid, storage_db.uuid, file_db.num_slices,
+                                  str(file_db.author_id), file_db.is_public)
+
+
+async def load_file_s3(file_uuid, session, request_id, num_images, background_task=None):
+    file_db = await fileManager.get_metafile(
+        session, file_uuid, num_images, request_id
+    )
+    storage_db = await fileManager.get_storage(session, file_db)
+    file_bytes, spacing = await load_volume_cold(storage_db.uuid, request_id, background_task)
+    if background_task:
+        background_task.add_task(warm_file_redis, file_db, storage_db, request_id, file_bytes, spacing)
+    return file_bytes
+
+
+async def load_slice_s3(file_uuid, session, request_id, num_images, background_task=None):
+    """
+    Промах Redis по одному срезу: срез из mmap дискового кэша, иначе заголовок и сам срез
+    читаются из S3 ranged GET'ами. Том целиком догружается в Redis (и на диск) уже в фоне.
+    Старые объекты (pickle, LVOL v1 в C-порядке) - скачиваются целиком.
+    """
+    file_db = await fileManager.get_metafile(
+        session, file_uuid, num_images, request_id
+    )
+    storage_db = await fileManager.get_storage(session, file_db)
+    image_slice = await disk_cache.get_slice(storage_db.uuid, num_images)
+    if image_slice is None:
+        obj_name = processed_obj_name(storage_db.uuid)
+        header = await s3_client.download_file(obj_name, settings.S3_PRIVATE_BUCKET_NAME, request_id,
+                                               byte_range=(0, HEADER_SIZE))
+        if not is_volume(header) or read_header_layout(header)[3] != LAYOUT_SLICES:
+            return (await load_file_s3(file_uuid, session, request_id, num_images, background_task))[:, :, num_images]
 
         api_logger.info(
-            "Cache miss: loading file from S3",
+            "Cache miss: loading slice from S3",
             extra={
                 "file_uuid": file_uuid,
+                "num_slice": num_images,
                 "request_id": request_id,
             }
         )
+        dtype, shape, _, _ = read_header_layout(header)
+        data = await s3_client.download_file(obj_name, settings.S3_PRIVATE_BUCKET_NAME, request_id,
+                                             byte_range=slice_range(num_images, dtype, shape))
+        image_slice = load_slice(data, dtype, shape)
+    if background_task:
+        background_task.add_task(warm_file_redis, file_db, storage_db, request_id)
+    return image_slice
 
-        file_db = await fileManager.get_metafile(
-            session, file_uuid, num_images, request_id
-        )
-        s3_file_bytes = await s3_client.download_file(
-            f"files/{file_uuid}.nii.processed",
-            settings.S3_PRIVATE_BUCKET_NAME,
-            request_id
-        )
 
-        file_bytes = pickle.load(io.BytesIO(s3_file_bytes))
-        if background_task:
-            background_task.add_task(load_files_redis, file_db.uuid,
-                                     file_bytes, file_db.num_slices,
-                                     str(file_db.author_id), file_db.is_public)
+async def get_storage_metadata(file_uuid, metadata):
+    """Метаданные данных файла в Redis (для дубликата - исходной загрузки), None - промах."""
+    data_uuid = storage_of(file_uuid, metadata)
+    if data_uuid == str(file_uuid):
+        return data_uuid, metadata
+    return data_uuid, await get_metadata(data_uuid)
+
+
+async def touch_files(file_uuid, metadata, data_uuid, data_metadata):
+    """Продлить TTL читаемого тома (и метаданных дубликата, если читают через него)."""
+    await touch_file(data_uuid, data_metadata)
+    if data_uuid != str(file_uuid):
+        await touch_file(file_uuid, metadata)
+
+
+async def get_file_bytes(file_uuid, session, request_id, num_images: int = 0,
+                         user_id: str = '', metadata=None, background_task=None):
+    """Весь обработанный том (H x W x depth)."""
+    if metadata is None:
+        metadata = await get_metadata(file_uuid)
+    if metadata:
+        check_access(metadata, num_images, user_id, request_id)
+        data_uuid, data_metadata = await get_storage_metadata(file_uuid, metadata)
+        if data_metadata:
+            await touch_files(file_uuid, metadata, data_uuid, data_metadata)
+            volume = await get_files_redis(data_uuid, data_metadata)
+            if volume is not None:
+                return volume
+    return await load_file_s3(file_uuid, session, request_id, num_images, background_task)
+
+
+async def get_file_slice(file_uuid, session, request_id, num_images: int = 0,
+                         user_id: str = '', metadata=None, background_task=None):
+    """Один срез num_images (H x W); при попадании в Redis читается только его кусок тома."""
+    if metadata is None:
+        metadata = await get_metadata(file_uuid)
+    if metadata:
+        check_access(metadata, num_images, user_id, request_id)
+        data_uuid, data_metadata = await get_storage_metadata(file_uuid, metadata)
+        if data_metadata:
+            await touch_files(file_uuid, metadata, data_uuid, data_metadata)
+            image_slice = await get_slice_redis(data_uuid, num_images, data_metadata)
+            if image_slice is not None:
+                return image_slice
+    return await load_slice_s3(file_uuid, session, request_id, num_images, background_task)
+
+
+async def get_file_slices(file_uuid, session, request_id, start: int, stop: int,
+                          user_id: str = '', metadata=None, background_task=None):
+    """Срезы [start, stop) (H x W x k); при попадании в Redis читаются только их куски тома."""
+    if metadata is None:
+        metadata = await get_metadata(file_uuid)
+    if metadata:
+        check_access(metadata, stop - 1, user_id, request_id)
+        data_uuid, data_metadata = await get_storage_metadata(file_uuid, metadata)
+        if data_metadata:
+            await touch_files(file_uuid, metadata, data_uuid, data_metadata)
+            slices = await get_slices_redis(data_uuid, start, stop, data_metadata)
+            if slices is not None:
+                return slices
+    return (await load_file_s3(file_uuid, session, request_id, stop - 1, background_task))[:, :, start:stop]
 
-    return file_bytes
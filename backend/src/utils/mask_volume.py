@@ -0,0 +1,86 @@
+import struct
+
+from fastapi import HTTPException
+
+from src.config import settings
+from src.logger import s3_logger
+from src.service.local_cache import local_cache
+from src.service.masks import HEADER, check_slice, read_header, slice_range, unpack_slice, unpack_slice_bytes
+from src.service.contours import mask_to_polygons
+from src.service.redis_conn import get_mask_cached, load_mask_cached, get_mask_range_cached
+from src.service.s3 import s3_client
+
+
+def mask_obj_name(file_uuid) -> str:
+    return f"files/{file_uuid}.nii.mask"
+
+
+async def upload_mask_volume(file_uuid, packed: bytes, request_id):
+    await load_mask_cached(file_uuid, packed)
+    await s3_client.upload_file(packed, mask_obj_name(file_uuid), settings.S3_PRIVATE_BUCKET_NAME, request_id)
+
+
+async def get_mask_volume(file_uuid, request_id) -> bytes | None:
+    """
+    Упакованный том масок из Redis, иначе из S3. None, если том ещё не сегментировали
+    или S3 сейчас недоступен (тогда вызывающий считает маски моделью).
+    """
+    packed = await get_mask_cached(file_uuid)
+    if packed is not None:
+        # b'' - запомненное отсутствие тома, чтобы не ходить в S3 на каждый промах
+        return packed or None
+    try:
+        packed = await s3_client.download_file(mask_obj_name(file_uuid), settings.S3_PRIVATE_BUCKET_NAME, request_id)
+    except HTTPException:
+        await load_mask_cached(file_uuid, b'')
+        return None
+    except Exception as e:
+        # Таймаут, 5xx и т.п.: отсутствие не запоминаем, просто обходимся без тома
+        s3_logger.warning(
+            "Mask volume is unavailable in S3",
+            extra={"file_uuid": str(file_uuid), "error": str(e), "request_id": request_id}
+        )
+        return None
+    await load_mask_cached(file_uuid, packed)
+    return packed
+
+
+async def get_mask_slice(file_uuid, num_slice, request_id):
+    """
+    Маска одного среза. Из Redis читаются только заголовок и байты среза (GETRANGE),
+    том целиком - лишь когда его нет в Redis (из S3, заодно кладётся в Redis).
+    """
+    key = ('mask_header', str(file_uuid))
+    dims = local_cache.get(key)
+    if dims is None:
+        header = await get_mask_range_cached(file_uuid, 0, HEADER.size)
+        if header == b'':
+            return None
+        if header is not None:
+            dims = read_header(header)
+            local_cache.set(key, dims)
+    if dims is not None:
+        depth, height, width = dims
+        check_slice(num_slice, depth)
+        start, end = slice_range(num_slice, height, width)
+        data = await get_mask_range_cached(file_uuid, start, end)
+        if data is not None:
+            if len(data) != end - start:
+                raise ValueError("Truncated mask volume")
+            return unpack_slice_bytes(data, height, width)
+
+    packed = await get_mask_volume(file_uuid, request_id)
+    return None if packed is None else unpack_slice(packed, num_slice)
+
+
+async def get_contours_from_mask(file_uuid, num_slice, request_id):
+    """Контуры среза из сохранённого тома масок, без модели. None, если тома масок нет."""
+    try:
+        mask = await get_mask_slice(file_uuid, num_slice, request_id)
+    except (ValueError, IndexError, struct.error) as e:
+        s3_logger.warning(
+            "Stored mask volume is unusable",
+            extra={"file_uuid": str(file_uuid), "num_slice": num_slice, "error": str(e), "request_id": request_id}
+        )
+        return None
+    return None if mask is None else mask_to_polygons(mask)
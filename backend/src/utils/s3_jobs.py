@@ -1,50 +1,64 @@
-import io
-import pickle
+import asyncio
+import os
 
 from fastapi import HTTPException, status, BackgroundTasks
 
 from src.config import settings
 from src.logger import s3_logger
 from src.service.model import modelManager
-from src.service.redis_conn import get_contours_cached
+from src.service.inference import inference_executor
+from src.service.redis_conn import get_metadata
 from src.service.s3 import s3_client
-from src.utils.file import get_file_bytes
+from src.service.disk_cache import disk_cache
+from src.utils.derivatives import get_slice_contours
+from src.utils.file import get_file_slice, resolve_storage
+
+
+async def upload_nii_s3(nii_file, obj_name, request_id):
+    try:
+        await s3_client.upload_file(nii_file, obj_name, settings.S3_PRIVATE_BUCKET_NAME, request_id)
+    finally:
+        nii_file.close()
+
+
+async def upload_processed_s3(file_uuid, processed_path, obj_name, request_id):
+    """
+    Обработанный том из временного LVOL-файла: в дисковый кэш и в S3 (multipart, по частям),
+    в памяти не больше нескольких частей; затем файл удаляется.
+    """
+    try:
+        await disk_cache.put_file(file_uuid, processed_path)
+        with open(processed_path, 'rb') as processed:
+            await s3_client.upload_file(processed, obj_name, settings.S3_PRIVATE_BUCKET_NAME, request_id)
+    finally:
+        os.unlink(processed_path)
 
 
 async def upload_files_to_s3(
         background_tasks: BackgroundTasks,
         obj_name,
-        file_bytes,
-        image_volume,
+        nii_file,
+        file_uuid,
+        processed_path,
         request_id,
 ) -> None:
+    """
+    nii_file - временный файл с исходным .nii, закрывается после загрузки в S3;
+    processed_path - временный LVOL обработанного тома, удаляется после загрузки.
+    """
     try:
-        background_tasks.add_task(
-            s3_client.upload_file,
-            file_obj=file_bytes,
-            obj_name=obj_name,
-            bucket_name=settings.S3_PRIVATE_BUCKET_NAME,
-            request_id=request_id
-        )
-
-        buffer = io.BytesIO()
-        pickle.dump(image_volume, buffer)
-        buffer.seek(0)
-
-        background_tasks.add_task(
-            s3_client.upload_file,
-            file_obj=buffer.getvalue(),
-            obj_name=f"{obj_name}.processed",
-            bucket_name=settings.S3_PRIVATE_BUCKET_NAME,
-            request_id=request_id
-        )
+        file_size = nii_file.seek(0, 2)
+        nii_file.seek(0)
+        background_tasks.add_task(upload_nii_s3, nii_file, obj_name, request_id)
+        background_tasks.add_task(upload_processed_s3, file_uuid, processed_path, f"{obj_name}.processed",
+                                  request_id)
 
         s3_logger.info(
             "Files scheduled for upload to S3",
             extra={
                 "object_name": obj_name,
-                "file_size": len(file_bytes),
-                "processed_size": buffer.getbuffer().nbytes,
+                "file_size": file_size,
+                "processed_size": os.path.getsize(processed_path),
                 "request_id": request_id,
             }
         )
@@ -67,14 +81,18 @@ async def upload_files_to_s3(
 async def create_add_photo_s3(obj, request_id, session):
     try:
         obj.name = f'{obj.author_uuid}/{obj.uuid}.png'
-        file_bytes = await get_file_bytes(file_uuid=obj.file_uuid, session=session, request_id=request_id,
-                                          num_images=obj.num_images, )
+        image_slice = await get_file_slice(file_uuid=obj.file_uuid, session=session, request_id=request_id,
+                                           num_images=obj.num_images, )
+
+        img = await asyncio.to_thread(modelManager.pred_slice, image_slice)
+
+        async def load_image():
+            return img
 
-        img = modelManager.pred_image(file_bytes, obj.num_images)
-        contours = await get_contours_cached(obj.file_uuid, obj.num_images)
-        if contours is None:
-            contours = modelManager.get_result_contours(img)
-        result_img = modelManager.create_photo_with_contours(img, contours)
+        data_uuid = await resolve_storage(obj.file_uuid, await get_metadata(obj.file_uuid), session)
+        contours = await get_slice_contours(data_uuid, obj.num_images, load_image, request_id)
+        result_img = await inference_executor.run(modelManager.create_photo_with_contours, img, contours,
+                                                  request_id=request_id)
 
         await s3_client.upload_file(result_img, obj.name,
                                     settings.S3_BUCKET_NAME, request_id)
@@ -99,12 +117,13 @@ async def create_add_photo_s3(obj, request_id, session):
 async def save_add_photo_s3_contour(obj, request_id, session):
     try:
         name = f'contour/{obj.author_id}/{obj.id}_version_{obj.version}.png'
-        file_bytes = await get_file_bytes(file_uuid=obj.file_uuid, session=session, request_id=request_id,
-                                          num_images=obj.num_images, )
+        image_slice = await get_file_slice(file_uuid=obj.file_uuid, session=session, request_id=request_id,
+                                           num_images=obj.num_images, )
 
-        img = modelManager.pred_image(file_bytes, obj.num_images)
+        img = await asyncio.to_thread(modelManager.pred_slice, image_slice)
         contours = obj.contours.get('points')
-        result_img = modelManager.create_photo_with_contours(img, contours)
+        result_img = await inference_executor.run(modelManager.create_photo_with_contours, img, contours,
+                                                  request_id=request_id)
 
         await s3_client.upload_file(result_img, name,
                                     settings.S3_BUCKET_NAME, request_id)
@@ -0,0 +1,84 @@
+import hashlib
+import os
+import tempfile
+import zlib
+
+import nibabel as nib
+import numpy as np
+
+from src.service.volume_format import quantize_volume, create_volume_file
+
+GZIP_MAGIC = b'\x1f\x8b'
+READ_CHUNK = 1024 * 1024
+
+
+async def spool_upload(file, max_memory: int):
+    """
+    Копирует загрузку во временный файл (в памяти до max_memory байт, дальше на диске),
+    .nii.gz распаковывается на лету. Хэш считается по несжатому .nii,
+    так что одно исследование в .nii и .nii.gz даёт один и тот же хэш.
+    :return: (временный файл с несжатым .nii, размер загрузки в байтах, sha256 hex)
+    """
+    spooled = tempfile.SpooledTemporaryFile(max_size=max_memory)
+    content_hash = hashlib.sha256()
+    decompressor = None
+    size = 0
+    try:
+        while chunk := await file.read(READ_CHUNK):
+            if size == 0 and chunk.startswith(GZIP_MAGIC):
+                decompressor = zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+            size += len(chunk)
+            data = decompressor.decompress(chunk) if decompressor else chunk
+            content_hash.update(data)
+            spooled.write(data)
+        if decompressor:
+            data = decompressor.flush()
+            content_hash.update(data)
+            spooled.write(data)
+            if not decompressor.eof:
+                raise ValueError("Truncated gzip stream")
+    except Exception:
+        spooled.close()
+        raise
+    spooled.seek(0)
+    return spooled, size, content_hash.hexdigest()
+
+
+def decode_nii(fileobj, budget_bytes: int, dtype: str = 'float32', tmp_dir: str | None = None):
+    """
+    Читает .nii через ArrayProxy кусками срезов, не загружая файл и float64-копию целиком.
+    Нормализация как в preprocess_im (clip >= 0, деление на максимум), результат сразу в dtype хранения
+    пишется во временный LVOL-файл (LAYOUT_SLICES) - его же потом частями грузим в S3 и дисковый кэш.
+    :return: (нормализованный том H x W x depth поверх memmap файла, размер вокселя, путь к файлу)
+    """
+    file_holder = nib.FileHolder(fileobj=fileobj)
+    nii_image = nib.Nifti1Image.from_file_map({'header': file_holder, 'image': file_holder})
+    proxy = nii_image.dataobj
+    shape = proxy.shape
+    if len(shape) != 3:
+        raise ValueError(f"Expected 3D volume, got shape {shape}")
+
+    # Сколько срезов за раз помещается в бюджет (float32 + исходный тип с запасом)
+    step = max(1, budget_bytes // (shape[0] * shape[1] * 8))
+    chunks = [(start, min(start + step, shape[2])) for start in range(0, shape[2], step)]
+
+    # Первый проход - максимум, второй - нормализация и запись в итоговый массив
+    max_val = 0.0
+    for start, stop in chunks:
+        max_val = max(max_val, float(np.max(np.asarray(proxy[:, :, start:stop], dtype=np.float32))))
+    max_val = max_val or 1.0
+
+    spacing = tuple(float(z) for z in nii_image.header.get_zooms()[:3])
+    fd, path = tempfile.mkstemp(dir=tmp_dir or None, suffix='.lvol')
+    os.close(fd)
+    try:
+        volume = create_volume_file(path, shape, dtype, spacing)
+        for start, stop in chunks:
+            chunk = np.asarray(proxy[:, :, start:stop], dtype=np.float32)
+            np.clip(chunk, 0, None, out=chunk)
+            chunk /= max_val
+            volume[:, :, start:stop] = quantize_volume(chunk, dtype)
+    except BaseException:
+        os.unlink(path)
+        raise
+    return volume, spacing, path
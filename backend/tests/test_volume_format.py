@@ -0,0 +1,44 @@
+import itertools
+import pickle
+
+import numpy as np
+import pytest
+
+from src.service.volume_format import (
+    STORAGE_DTYPES, LAYOUT_C, LAYOUT_SLICES, quantize_volume, dequantize, dump_volume, load_volume,
+    load_volume_any,
+)
+
+# Допуск на одну ступень квантования самого грубого из двух типов
+TOLERANCE = {'float32': 1e-6, 'float16': 1e-3, 'uint16': 1 / 65535}
+
+
+@pytest.mark.parametrize('source, target', list(itertools.product(STORAGE_DTYPES, repeat=2)))
+def test_requantize_round_trip(source, target):
+    rng = np.random.default_rng(0)
+    volume = rng.random((8, 6, 5), dtype=np.float32)
+    stored = quantize_volume(volume, source)
+
+    restored = dequantize(quantize_volume(stored, target))
+
+    assert restored.dtype == np.float32
+    assert restored.min() >= 0.0 and restored.max() <= 1.0
+    np.testing.assert_allclose(restored, volume, atol=TOLERANCE[source] + TOLERANCE[target])
+
+
+@pytest.mark.parametrize('layout', (LAYOUT_C, LAYOUT_SLICES))
+@pytest.mark.parametrize('dtype', STORAGE_DTYPES)
+def test_dump_load_round_trip(dtype, layout):
+    volume = quantize_volume(np.random.default_rng(1).random((4, 3, 2), dtype=np.float32), dtype)
+    np.testing.assert_array_equal(load_volume(dump_volume(volume, layout=layout)), volume)
+
+
+@pytest.mark.parametrize('protocol', range(pickle.HIGHEST_PROTOCOL + 1))
+def test_legacy_pickle_protocols(protocol):
+    volume = np.random.default_rng(2).random((4, 3, 2), dtype=np.float32)
+    np.testing.assert_array_equal(load_volume_any(pickle.dumps(volume, protocol=protocol)), volume)
+
+
+def test_legacy_pickle_rejects_other_globals():
+    with pytest.raises(pickle.UnpicklingError):
+        load_volume_any(pickle.dumps(print))